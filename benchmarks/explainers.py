@@ -0,0 +1,248 @@
+# Measures the wall time, peak memory and number of model forwards of every explanation method on the sample graphs
+# of BAShapes and Mutag and on synthetic Barabasi-Albert graphs of increasing size, and compares two runs.
+# Every entry of the `methods` dictionaries is measured, and the `symmetric_methods` variants in rows labelled with
+# a `_symmetric` suffix.
+# Run from the project root:
+#   python -m benchmarks.explainers run --output before.json
+#   python -m benchmarks.explainers run --output after.json
+#   python -m benchmarks.explainers compare before.json after.json
+
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+
+import networkx as nx
+import numpy as np
+import torch
+
+from benchmarks.group_occlusion import ForwardCounter
+from experiments.ba_shapes import BAShapes
+from experiments.mutag import Mutag
+from explainers import node_methods, graph_methods
+
+DEFAULT_SIZES = [100, 1000, 10000, 100000]
+
+
+class PeakMemory:
+    """
+    Samples the resident memory of the process in a background thread, tensors allocated by torch are not visible to
+    tracemalloc
+    """
+
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+        self.peak = self.baseline = 0
+        self.running = False
+        self.thread = None
+
+    def resident(self):
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * self.page_size
+        except OSError:
+            return 0
+
+    def sample(self):
+        while self.running:
+            self.peak = max(self.peak, self.resident())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.peak = self.baseline = self.resident()
+        self.running = True
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.running = False
+        self.thread.join()
+        self.peak = max(self.peak, self.resident())
+        return False
+
+    def increase_mb(self):
+        return (self.peak - self.baseline) / 2 ** 20
+
+
+def barabasi_albert_request(experiment, num_edges, attach=3, seed=0):
+    """
+    :return: (nodes, edges) of a Barabasi-Albert graph with about `num_edges` directed edges and random node categories
+    """
+    num_nodes = max(attach + 1, num_edges // (2 * attach))
+    g = nx.barabasi_albert_graph(num_nodes, attach, seed=seed)
+    rng = np.random.default_rng(seed)
+    categories = [category['value'] for category in experiment.node_categories()]
+    nodes = [{'id': idx, 'feat': int(rng.choice(categories))} for idx in range(num_nodes)]
+    edges = list(g.edges())
+    return nodes, edges + [(v, u) for u, v in edges]
+
+
+def make_cases(experiment, sizes, num_samples):
+    """
+    :return: list of (graph name, nodes, edges) requests, the sample graphs followed by the synthetic graphs
+    """
+    cases = []
+    try:
+        for idx, (nodes, edges) in enumerate(experiment.sample_requests()[:num_samples]):
+            cases.append((f'sample_{idx}', nodes, edges))
+    except Exception as e:
+        print(f'{experiment.name}: skipping the sample graphs, {type(e).__name__}: {e}')
+    for size in sizes:
+        nodes, edges = barabasi_albert_request(experiment, size)
+        cases.append((f'ba_{size}', nodes, edges))
+    return cases
+
+
+def method_variants(experiment, names):
+    """
+    :param names: method names to measure, all by default. A name selects both the plain and the symmetric variant.
+    :return: list of (label, explain function) tuples
+    """
+    module = graph_methods if experiment.is_graph_classification() else node_methods
+    variants = [(name, function) for name, function in module.methods.items()]
+    variants += [(f'{name}_symmetric', function) for name, function in module.symmetric_methods.items()]
+    return [(label, function) for label, function in variants
+            if not names or label in names or label.replace('_symmetric', '') in names]
+
+
+def measure(experiment, counter, explain_function, nodes, edges, repeats):
+    data = experiment.make_data(nodes, edges)
+    if experiment.is_graph_classification():
+        target = experiment.predict_graph(nodes, edges)
+        args = (experiment.model, data.x, data.edge_index, target)
+    else:
+        # node 0 is the oldest node of the Barabasi-Albert graphs and has the largest receptive field
+        target = experiment.predict_nodes(nodes, edges)[0]
+        args = (experiment.model, 0, data.x, data.edge_index, target)
+    times, memory, forwards = [], [], []
+    for _ in range(repeats):
+        counter.count = 0
+        with PeakMemory() as peak:
+            start = time.perf_counter()
+            explain_function(*args)
+            times.append(time.perf_counter() - start)
+        memory.append(peak.increase_mb())
+        forwards.append(counter.count)
+    return {'time': float(np.median(times)), 'peak_memory_mb': max(memory), 'forwards': max(forwards)}
+
+
+def run_experiment(experiment, methods, sizes, num_samples, repeats, time_limit):
+    counter = ForwardCounter(experiment.model)
+    cases = make_cases(experiment, sizes, num_samples)
+    results = []
+    for method, explain_function in method_variants(experiment, methods):
+        too_slow = False
+        for graph, nodes, edges in cases:
+            result = {'experiment': experiment.name, 'graph': graph, 'method': method, 'num_nodes': len(nodes),
+                      'num_edges': len(edges)}
+            if too_slow and graph.startswith('ba_'):
+                # the graphs are sorted by size, larger graphs would take even longer
+                result['status'] = 'skipped'
+            else:
+                try:
+                    result.update(measure(experiment, counter, explain_function, nodes, edges, repeats))
+                    result['status'] = 'ok'
+                    too_slow = result['time'] > time_limit
+                except Exception as e:
+                    result['status'] = f'error: {type(e).__name__}: {e}'
+            results.append(result)
+            if result['status'] == 'ok':
+                print(f'{experiment.name:>10} {method:>22} {graph:>10} {len(edges):>7} edges: '
+                      f'{result["time"] * 1000:10.1f}ms {result["peak_memory_mb"]:8.1f}MB '
+                      f'{result["forwards"]:7} forwards')
+            else:
+                print(f'{experiment.name:>10} {method:>22} {graph:>10} {len(edges):>7} edges: {result["status"]}')
+    return results
+
+
+def run(args):
+    torch.manual_seed(0)
+    np.random.seed(0)
+    results = []
+    for cls in [BAShapes, Mutag]:
+        if args.experiments and cls.name not in args.experiments:
+            continue
+        results += run_experiment(cls(), args.methods, args.sizes, args.samples, args.repeats, args.time_limit)
+    report = {'environment': {'python': sys.version.split()[0],
+                              'torch': torch.__version__,
+                              'platform': platform.platform(),
+                              'threads': torch.get_num_threads()},
+              'args': vars(args),
+              'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f'wrote {len(results)} results to {args.output}')
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    def key(result):
+        return result['experiment'], result['graph'], result['method']
+
+    baseline_results = {key(result): result for result in baseline['results'] if result['status'] == 'ok'}
+    regressions = 0
+    for result in current['results']:
+        old = baseline_results.get(key(result))
+        if old is None:
+            continue
+        name = '%s %s %s' % key(result)
+        if result['status'] != 'ok':
+            print(f'REGRESSION {name}: {result["status"]}')
+            regressions += 1
+            continue
+        problems = []
+        if result['time'] > old['time'] * (1 + args.threshold) and result['time'] - old['time'] > args.min_time:
+            problems.append(f'time {old["time"] * 1000:.1f}ms -> {result["time"] * 1000:.1f}ms')
+        if result['forwards'] > old['forwards']:
+            problems.append(f'forwards {old["forwards"]} -> {result["forwards"]}')
+        if (result['peak_memory_mb'] > old['peak_memory_mb'] * (1 + args.threshold) and
+                result['peak_memory_mb'] - old['peak_memory_mb'] > args.min_memory):
+            problems.append(f'peak memory {old["peak_memory_mb"]:.1f}MB -> {result["peak_memory_mb"]:.1f}MB')
+        if problems:
+            print(f'REGRESSION {name}: ' + ', '.join(problems))
+            regressions += 1
+        elif args.verbose:
+            print(f'ok {name}: {old["time"] * 1000:.1f}ms -> {result["time"] * 1000:.1f}ms')
+    print(f'{regressions} regressions')
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run')
+    run_parser.add_argument('--output', default='explainers_benchmark.json')
+    run_parser.add_argument('--experiments', nargs='*', help='names of the experiments, all by default')
+    run_parser.add_argument('--methods', nargs='*',
+                            help='explanation methods, all by default, with their symmetric variants if they have one')
+    run_parser.add_argument('--sizes', nargs='*', type=int, default=DEFAULT_SIZES,
+                            help='approximate number of directed edges of the synthetic graphs')
+    run_parser.add_argument('--samples', type=int, default=3, help='number of sample graphs of each experiment')
+    run_parser.add_argument('--repeats', type=int, default=1)
+    run_parser.add_argument('--time-limit', type=float, default=30.0,
+                            help='a method is not run on larger synthetic graphs once it takes longer than this')
+    compare_parser = subparsers.add_parser('compare')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative increase')
+    compare_parser.add_argument('--min-time', type=float, default=0.005, help='ignored time increase in seconds')
+    compare_parser.add_argument('--min-memory', type=float, default=10.0, help='ignored memory increase in MB')
+    compare_parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == '__main__':
+    main()
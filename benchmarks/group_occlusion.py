@@ -0,0 +1,100 @@
+# Compares hierarchical group occlusion with exhaustive occlusion: number of forwards, time and top-k agreement.
+# For undirected experiments both directions of each edge are removed together and the top k undirected edges compared.
+# Run from the project root: python -m benchmarks.group_occlusion --top-k 5
+
+import argparse
+import time
+
+import numpy as np
+
+from experiments.ba_shapes import BAShapes
+from experiments.mutag import Mutag
+from explainers import graph_methods, node_methods
+from explainers.batched import masked_forward, removal_masks
+from explainers.symmetric import edge_pairs, split_to_edges
+
+
+class ForwardCounter:
+    def __init__(self, model):
+        self.count = 0
+        model.register_forward_hook(self.hook)
+
+    def hook(self, module, inputs, output):
+        self.count += 1
+
+
+def top_k_overlap(expected, result, k, pairs=None):
+    if pairs is not None:
+        # attributions of the undirected edges
+        expected, result = np.bincount(pairs, np.abs(expected)), np.bincount(pairs, np.abs(result))
+    expected_top = set(np.argsort(-np.abs(expected))[:k].tolist())
+    result_top = set(np.argsort(-np.abs(result))[:k].tolist())
+    return len(expected_top & result_top) / k
+
+
+def graph_occlusion_undirected(model, x, edge_index, target):
+    # exhaustive occlusion of the undirected edges of a graph, in one batched evaluation
+    pairs, num_pairs = edge_pairs(edge_index, x.shape[0])
+    pairs_numpy = pairs.cpu().numpy()
+    removed = [np.array([], dtype=int)] + [np.flatnonzero(pairs_numpy == pair) for pair in range(num_pairs)]
+    scores = masked_forward(model, x, edge_index, removal_masks(edge_index.shape[1], removed))[:, target].numpy()
+    return split_to_edges(scores[0] - scores[1:], pairs)
+
+
+def run(name, counter, exhaustive, hierarchical, args, top_k, undirected):
+    stats = {'exhaustive': [0, 0.0], 'hierarchical': [0, 0.0]}
+    overlaps = []
+    for explain_args in args:
+        results = {}
+        for method, function in [('exhaustive', exhaustive), ('hierarchical', hierarchical)]:
+            counter.count = 0
+            start = time.perf_counter()
+            results[method] = function(*explain_args)
+            stats[method][0] += counter.count
+            stats[method][1] += time.perf_counter() - start
+        x, edge_index = explain_args[-3], explain_args[-2]
+        pairs = edge_pairs(edge_index, x.shape[0])[0].cpu().numpy() if undirected else None
+        overlaps.append(top_k_overlap(results['exhaustive'], results['hierarchical'], top_k, pairs))
+    for method, (forwards, elapsed) in stats.items():
+        print(f'{name:>10} {method:>12}: {forwards / len(args):8.1f} forwards, {elapsed / len(args) * 1000:8.1f}ms')
+    print(f'{name:>10} top-{top_k} overlap with exhaustive occlusion: {np.mean(overlaps):.1%}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--threshold', type=float, default=0.0)
+    parser.add_argument('--samples', type=int, default=10)
+    args = parser.parse_args()
+
+    experiment = BAShapes()
+    counter = ForwardCounter(experiment.model)
+    explain_args = []
+    for nodes, edges in experiment.sample_requests()[:args.samples]:
+        data = experiment.make_data(nodes, edges)
+        target = experiment.predict_nodes(nodes, edges)[0]
+        explain_args.append((experiment.model, 0, data.x, data.edge_index, target))
+    undirected = not experiment.is_directed()
+    run(experiment.name, counter,
+        node_methods.explain_occlusion_symmetric if undirected else node_methods.explain_occlusion,
+        lambda *a: node_methods.explain_occlusion_hierarchical(*a, top_k=args.top_k, threshold=args.threshold,
+                                                               undirected=undirected),
+        explain_args, args.top_k, undirected)
+
+    experiment = Mutag()
+    counter = ForwardCounter(experiment.model)
+    explain_args = []
+    for nodes, edges in experiment.sample_requests()[:args.samples]:
+        data = experiment.make_data(nodes, edges)
+        target = experiment.predict_graph(nodes, edges)
+        explain_args.append((experiment.model, data.x, data.edge_index, target))
+    undirected = not experiment.is_directed()
+    run(experiment.name, counter,
+        graph_occlusion_undirected if undirected else graph_methods.explain_occlusion,
+        lambda *a: graph_methods.explain_occlusion_hierarchical(*a, top_k=args.top_k, threshold=args.threshold,
+                                                                undirected=undirected),
+        explain_args, args.top_k, undirected)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+# Compares the per-request prediction latency of the inference backends on the CPU.
+# Run from the project root: python -m benchmarks.inference_backends --backends eager torchscript compile onnx
+
+import argparse
+import statistics
+import time
+
+import torch
+
+from experiments.ba_shapes import BAShapes
+from experiments.inference import BACKENDS
+from experiments.mutag import Mutag
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backends', nargs='+', default=BACKENDS)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=1)
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+
+    for experiment in [BAShapes(), Mutag()]:
+        graphs = experiment.sample_requests()
+        for backend in args.backends:
+            experiment.set_inference_backend(backend)
+            if experiment.inference_backend != backend:
+                print(f'{experiment.name:>10} {backend:>12}: not available')
+                continue
+            # warm up, e.g. torch.compile compiles on the first calls
+            for nodes, edges in graphs[:3]:
+                experiment.predict(nodes, edges)
+            latencies = []
+            for _ in range(args.repeat):
+                for nodes, edges in graphs:
+                    start = time.perf_counter()
+                    experiment.predict(nodes, edges)
+                    latencies.append(time.perf_counter() - start)
+            latencies.sort()
+            print(f'{experiment.name:>10} {backend:>12}: median {statistics.median(latencies) * 1000:.2f}ms, '
+                  f'p95 {latencies[int(len(latencies) * 0.95)] * 1000:.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
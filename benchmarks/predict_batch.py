@@ -0,0 +1,40 @@
+# Compares the throughput of one-by-one graph prediction with batched prediction.
+# Run from the project root: python -m benchmarks.predict_batch --repeat 5
+
+import argparse
+import time
+
+from experiments.mutag import Mutag
+
+
+def to_graph(sample):
+    edges = [(u, v) for u, v in sample['edges']] + [(v, u) for u, v in sample['edges']]
+    return sample['nodes'], edges
+
+
+def measure(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--copies', type=int, default=10, help='number of times the sample graphs are repeated')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 16, 64, 256])
+    args = parser.parse_args()
+
+    experiment = Mutag()
+    graphs = [to_graph(sample) for sample in experiment.sample_graphs()] * args.copies
+
+    elapsed = measure(lambda: [experiment.predict_graph(nodes, edges) for nodes, edges in graphs], args.repeat)
+    print(f'predict_graph loop: {len(graphs) / elapsed:10.1f} graphs/s')
+    for batch_size in args.batch_sizes:
+        elapsed = measure(lambda: experiment.predict_graphs(graphs, batch_size=batch_size), args.repeat)
+        print(f'predict_graphs batch_size={batch_size:<4}: {len(graphs) / elapsed:10.1f} graphs/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+# Reports the prediction agreement, latency and model size of the int8 dynamically quantized models.
+# Run from the project root: python -m benchmarks.quantization
+
+import argparse
+import statistics
+import time
+
+import torch
+
+from experiments.ba_shapes import BAShapes
+from experiments.inference import model_size, quantize_model
+from experiments.mutag import Mutag
+
+
+def median_latency(experiment, graphs, repeat):
+    latencies = []
+    for _ in range(repeat):
+        for nodes, edges in graphs:
+            start = time.perf_counter()
+            experiment.predict(nodes, edges)
+            latencies.append(time.perf_counter() - start)
+    return statistics.median(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=1)
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+
+    for experiment in [BAShapes(), Mutag()]:
+        graphs = experiment.sample_requests()
+        quantized = quantize_model(experiment.model)
+        agreement = experiment.prediction_agreement(quantized)
+        fp32_latency = median_latency(experiment, graphs, args.repeat)
+        experiment.inference_model = quantized
+        int8_latency = median_latency(experiment, graphs, args.repeat)
+        fp32_size, int8_size = model_size(experiment.model), model_size(quantized)
+        print(f'{experiment.name:>10}: agreement {agreement:.1%}, '
+              f'latency {fp32_latency * 1000:.2f}ms -> {int8_latency * 1000:.2f}ms, '
+              f'model size {fp32_size / 1024:.1f}KiB -> {int8_size / 1024:.1f}KiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# Compares the sparse matrix implementation of the pagerank and distance baselines with the networkx implementation.
+# Run from the project root: python -m benchmarks.sparse_baselines --edges 100000
+
+import argparse
+import time
+
+import networkx as nx
+import numpy as np
+import torch
+from torch_geometric.data import Data
+from torch_geometric.utils import to_networkx, from_networkx
+
+from explainers.sparse_graph import distance_attributions, pagerank_attributions, node_attr_to_edge_batch
+
+
+def networkx_pagerank(edge_index, num_nodes, node_idx):
+    g = to_networkx(Data(edge_index=edge_index, num_nodes=num_nodes))
+    pagerank = nx.pagerank(g, personalization={node_idx: 1})
+    node_attr = np.zeros((1, num_nodes))
+    for node, value in pagerank.items():
+        node_attr[0, node] = value
+    return node_attr_to_edge_batch(edge_index, node_attr)[0]
+
+
+def networkx_distance(edge_index, num_nodes, node_idx):
+    g = to_networkx(Data(edge_index=edge_index, num_nodes=num_nodes))
+    length = nx.shortest_path_length(g, target=node_idx)
+    return np.array([1 / (length[node] + 1) if node in length else 0 for node in edge_index[1].tolist()])
+
+
+def measure(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--edges', type=int, default=100000, help='approximate number of directed edges')
+    parser.add_argument('--attach', type=int, default=5, help='edges added for each node of the Barabasi-Albert graph')
+    parser.add_argument('--nodes-per-call', type=int, default=100)
+    args = parser.parse_args()
+
+    num_nodes = args.edges // (2 * args.attach)
+    edge_index = from_networkx(nx.barabasi_albert_graph(num_nodes, args.attach, seed=0)).edge_index
+    print(f'graph with {num_nodes} nodes and {edge_index.shape[1]} edges')
+    node_idx = 0
+    for name, baseline, sparse in [('pagerank', networkx_pagerank, pagerank_attributions),
+                                   ('distance', networkx_distance, distance_attributions)]:
+        baseline_time, expected = measure(lambda: baseline(edge_index, num_nodes, node_idx))
+        sparse_time, result = measure(lambda: sparse(edge_index, num_nodes, [node_idx])[0])
+        error = np.abs(expected - result).max()
+        nodes = torch.arange(args.nodes_per_call)
+        batch_time, _ = measure(lambda: sparse(edge_index, num_nodes, nodes))
+        print(f'{name:>8}: networkx {baseline_time * 1000:8.1f}ms, sparse {sparse_time * 1000:8.1f}ms '
+              f'({baseline_time / sparse_time:.1f}x), {args.nodes_per_call} nodes in one call '
+              f'{batch_time / args.nodes_per_call * 1000:.1f}ms per node, max abs difference {error:.2e}')
+
+
+if __name__ == '__main__':
+    main()
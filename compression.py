@@ -0,0 +1,52 @@
+import gzip
+import os
+
+# brotli is optional, responses are gzip compressed without it
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# smaller responses are sent uncompressed
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+# fast settings, the responses are compressed on every request
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+
+
+def accepted_encodings(accept_encoding):
+    """
+    :param accept_encoding: value of the Accept-Encoding header, e.g. "gzip, deflate, br;q=0.9"
+    :return: set of the encodings that the client accepts
+    """
+    encodings = set()
+    for item in accept_encoding.split(','):
+        name, *params = [part.strip() for part in item.split(';')]
+        quality = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if name and quality > 0:
+            encodings.add(name.lower())
+    return encodings
+
+
+def choose_encoding(accept_encoding):
+    """
+    :return: "br", "gzip" or None if the client accepts neither
+    """
+    encodings = accepted_encodings(accept_encoding)
+    if brotli is not None and 'br' in encodings:
+        return 'br'
+    if 'gzip' in encodings:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
@@ -0,0 +1,177 @@
+# Predicts the runtime of the explanation methods from the size of the graph and the method parameters.
+# The model is fitted from the timings recorded in `COST_MODEL_PATH`, which the web service appends to after every
+# explanation. Run `python cost_model.py` to record initial timings by explaining the sample graphs.
+
+import argparse
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+COST_MODEL_PATH = os.environ.get('COST_MODEL_PATH', 'cost_model.jsonl')
+# parameters which multiply the work of a method: (default value, maximum value used by the method), the maxima are
+# the limits in `explainers.node_methods` and `explainers.graph_methods`
+ITERATION_PARAMS = {
+    'gnnexplainer': {'epochs': (200, 600)},
+    'pgmexplainer': {'num_samples': (100, 300)},
+    'shapley': {'num_samples': (64, 1024)},
+    'ig': {'n_steps': (50, 200)},
+}
+# only the most recent timings of each experiment and method are used and kept in `COST_MODEL_PATH`
+MAX_OBSERVATIONS = int(os.environ.get('COST_MODEL_MAX_OBSERVATIONS', '1000'))
+# before any timing is recorded, the runtime is assumed proportional to edges x iterations with this constant
+PRIOR_WEIGHTS = np.array([math.log(1e-5), 1.0, 0.0, 1.0])
+PRIOR_STRENGTH = 1.0
+
+
+def iterations(method, params):
+    total = 1
+    for name, (default, maximum) in ITERATION_PARAMS.get(method, {}).items():
+        value = float(params.get(name, default))
+        total *= min(value, maximum) if maximum is not None else value
+    return max(total, 1)
+
+
+def features(receptive_nodes, receptive_edges, num_iterations):
+    # log-linear model, runtime = exp(w0) * (1 + edges)^w1 * (1 + nodes)^w2 * iterations^w3
+    return np.array([1.0, math.log1p(receptive_edges), math.log1p(receptive_nodes), math.log(num_iterations)])
+
+
+class CostModel:
+    """
+    One ridge regression of the log runtime for each experiment and method, pulled towards `PRIOR_WEIGHTS` when there
+    are few timings. The sufficient statistics of the last `max_observations` timings of each experiment and method
+    are kept, so new timings refine the model at no cost and older ones are forgotten. The file is rewritten with only
+    these timings when it is loaded and whenever it grows to twice their number.
+    """
+
+    def __init__(self, path=None, max_observations=MAX_OBSERVATIONS):
+        self.path = path
+        self.max_observations = max_observations
+        self.stats = {}
+        self.windows = {}
+        self.lines = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path=COST_MODEL_PATH, max_observations=MAX_OBSERVATIONS):
+        model = cls(path, max_observations)
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        model.observe(json.loads(line), persist=False)
+                        model.lines += 1
+            if model.lines > model.num_observations():
+                with model.lock:
+                    model.compact()
+        return model
+
+    def num_observations(self):
+        return sum(len(window) for window in self.windows.values())
+
+    def observe(self, observation, persist=True):
+        """
+        :param observation: dictionary with the `experiment`, `method`, `params`, `receptive_nodes`,
+        `receptive_edges` and the measured `seconds`
+        """
+        x = features(observation['receptive_nodes'], observation['receptive_edges'],
+                     iterations(observation['method'], observation['params']))
+        y = math.log(max(observation['seconds'], 1e-6))
+        key = (observation['experiment'], observation['method'])
+        with self.lock:
+            xtx, xty, count = self.stats.get(key, (np.zeros((len(x), len(x))), np.zeros(len(x)), 0))
+            xtx, xty, count = xtx + np.outer(x, x), xty + x * y, count + 1
+            window = self.windows.setdefault(key, deque())
+            window.append((observation, x, y))
+            if len(window) > self.max_observations:
+                _, old_x, old_y = window.popleft()
+                xtx, xty, count = xtx - np.outer(old_x, old_x), xty - old_x * old_y, count - 1
+            self.stats[key] = (xtx, xty, count)
+            if persist and self.path is not None:
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(observation) + '\n')
+                self.lines += 1
+                if self.lines > 2 * self.num_observations():
+                    self.compact()
+
+    def compact(self):
+        # rewrites the file with the timings in the windows, the caller holds the lock
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for window in self.windows.values():
+                for observation, _, _ in window:
+                    f.write(json.dumps(observation) + '\n')
+        os.replace(tmp_path, self.path)
+        self.lines = self.num_observations()
+
+    def estimate(self, experiment, method, receptive_nodes, receptive_edges, params):
+        """
+        :return: (expected runtime in seconds, number of recorded timings the estimate is based on)
+        """
+        with self.lock:
+            xtx, xty, count = self.stats.get((experiment, method), (np.zeros((4, 4)), np.zeros(4), 0))
+        weights = np.linalg.solve(xtx + PRIOR_STRENGTH * np.eye(4), xty + PRIOR_STRENGTH * PRIOR_WEIGHTS)
+        x = features(receptive_nodes, receptive_edges, iterations(method, params))
+        return math.exp(float(x @ weights)), count
+
+
+def calibrate(experiment, cost_model, methods, num_samples, nodes_per_sample, seed=0):
+    """
+    Records the runtime of every method on the sample graphs, with the default parameters and with a fraction of the
+    iterations so that their effect can be fitted
+    """
+    rng = np.random.default_rng(seed)
+    for nodes, edges in experiment.sample_requests()[:num_samples]:
+        if experiment.is_graph_classification():
+            node_indices = [None]
+        else:
+            node_indices = rng.choice(len(nodes), min(nodes_per_sample, len(nodes)), replace=False).tolist()
+        for node_index in node_indices:
+            receptive_nodes, receptive_edges = experiment.receptive_field_size(nodes, edges, node_index)
+            for name in methods:
+                for scale in [1, 0.25]:
+                    params = {param: max(1, int(default * scale))
+                              for param, (default, _) in ITERATION_PARAMS.get(name, {}).items()}
+                    if scale != 1 and not params:
+                        continue
+                    method = dict(params, name=name)
+                    start = time.perf_counter()
+                    if node_index is None:
+                        target = experiment.predict_graph(nodes, edges)
+                        experiment.explain_graph(nodes, edges, target, method)
+                    else:
+                        target = experiment.predict_nodes(nodes, edges)[node_index]
+                        experiment.explain_node(nodes, edges, node_index, target, method)
+                    cost_model.observe({'experiment': experiment.name, 'method': name, 'params': params,
+                                        'nodes': len(nodes), 'edges': len(edges), 'receptive_nodes': receptive_nodes,
+                                        'receptive_edges': receptive_edges, 'seconds': time.perf_counter() - start})
+        print(f'{experiment.name}: {sum(count for _, _, count in cost_model.stats.values())} timings recorded',
+              flush=True)
+
+
+def main():
+    from web_service import experiments_registry
+
+    parser = argparse.ArgumentParser(description='Records the runtime of the explanation methods on the sample graphs')
+    parser.add_argument('--experiments', nargs='+', default=None, help='experiment names, defaults to all')
+    parser.add_argument('--methods', nargs='+', default=None, help='defaults to all methods of each experiment')
+    parser.add_argument('--samples', type=int, default=10, help='number of sample graphs of each experiment')
+    parser.add_argument('--nodes-per-sample', type=int, default=3)
+    parser.add_argument('--output', default=COST_MODEL_PATH)
+    args = parser.parse_args()
+
+    cost_model = CostModel.load(args.output)
+    for experiment in experiments_registry.values():
+        if args.experiments is not None and experiment.name not in args.experiments:
+            continue
+        methods = args.methods or experiment.get_explain_methods()
+        calibrate(experiment, cost_model, methods, args.samples, args.nodes_per_sample)
+
+
+if __name__ == '__main__':
+    main()
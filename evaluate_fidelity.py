@@ -0,0 +1,88 @@
+# Compares explanation methods by their fidelity+ and fidelity- at several sparsity levels on the sample graphs.
+# Example: python evaluate_fidelity.py Mutag --methods sa ig occlusion --output mutag_fidelity.json
+
+import argparse
+import json
+import time
+
+import networkx as nx
+import numpy as np
+
+from experiments.base import BaseExperiment
+# noinspection PyUnresolvedReferences
+from experiments import *
+from explainers.fidelity import DEFAULT_SPARSITIES
+
+
+def find_experiment(name):
+    for cls in BaseExperiment.__subclasses__():
+        if cls.name == name:
+            return cls()
+    raise ValueError(f'Unknown experiment {name}')
+
+
+def explain(experiment, nodes, edges, node_index, target, method):
+    if node_index is None:
+        return experiment.explain_graph(nodes, edges, target, {'name': method})
+    return experiment.explain_node(nodes, edges, node_index, target, {'name': method})
+
+
+def explained_nodes(nodes, edges, center, count):
+    """
+    :return: indices of the `count` nodes of a sample closest to its center, whose receptive fields are least cut off
+    by the sample, or the first nodes if the sample has no center
+    """
+    if center is None:
+        return list(range(min(count, len(nodes))))
+    g = nx.Graph()
+    g.add_nodes_from(range(len(nodes)))
+    g.add_edges_from(edges)
+    distances = nx.single_source_shortest_path_length(g, center)
+    return sorted(distances, key=lambda idx: distances[idx])[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fidelity curves of explanation methods on the sample graphs')
+    parser.add_argument('experiment', help='name of the experiment, e.g. Mutag or BAShapes')
+    parser.add_argument('--methods', nargs='+', default=None, help='defaults to all methods of the experiment')
+    parser.add_argument('--sparsities', nargs='+', type=float, default=DEFAULT_SPARSITIES)
+    parser.add_argument('--nodes-per-sample', type=int, default=1,
+                        help='number of explained nodes of each sample in node classification experiments, the '
+                             'center of the sample and the nodes closest to it')
+    parser.add_argument('--output', default=None, help='optional JSON file for the curves of every explanation')
+    args = parser.parse_args()
+
+    experiment = find_experiment(args.experiment)
+    methods = args.methods or experiment.get_explain_methods()
+    items = []
+    for (nodes, edges), center in zip(experiment.sample_requests(), experiment.sample_centers()):
+        if experiment.is_graph_classification():
+            items.append((nodes, edges, None, experiment.predict_graph(nodes, edges)))
+        else:
+            predictions = experiment.predict_nodes(nodes, edges)
+            items.extend((nodes, edges, idx, predictions[idx])
+                         for idx in explained_nodes(nodes, edges, center, args.nodes_per_sample))
+
+    results = {}
+    print(f'{"method":>24} {"time":>8} ' + ' '.join(f'{f"s={sparsity:g}":>13}' for sparsity in args.sparsities))
+    for method in methods:
+        curves = []
+        start = time.perf_counter()
+        for nodes, edges, node_index, target in items:
+            attributions = explain(experiment, nodes, edges, node_index, target, method)
+            curves.append(experiment.evaluate_fidelity(nodes, edges, node_index, target, attributions,
+                                                       args.sparsities))
+        elapsed = time.perf_counter() - start
+        results[method] = curves
+        plus = np.mean([curve['fidelity_plus'] for curve in curves], axis=0)
+        minus = np.mean([curve['fidelity_minus'] for curve in curves], axis=0)
+        print(f'{method:>24} {elapsed:7.1f}s ' + ' '.join(f'{p:+.3f}/{m:+.3f}' for p, m in zip(plus, minus)))
+    print('each column shows the mean fidelity+/fidelity- over all explanations')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'experiment': args.experiment, 'sparsities': args.sparsities, 'results': results}, f)
+
+
+if __name__ == '__main__':
+    main()
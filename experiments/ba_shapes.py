@@ -1,12 +1,14 @@
 import json
 
 import networkx as nx
+import numpy as np
 import torch
 import torch.nn.functional as F
 from torch.nn import Sequential, Linear, ReLU
 from torch_geometric.nn import GNNExplainer, GINConv, MessagePassing, GCNConv, GraphConv
 
 from experiments.base import BaseExperiment
+from experiments.graph_store import GraphStore
 
 
 class Net(torch.nn.Module):
@@ -57,6 +59,14 @@ class BAShapes(BaseExperiment):
         model.load_state_dict(torch.load('experiments/BAShapes.pt'))
         model.eval()
         self.model = model
+        store_path = 'graph_store/BAShapes'
+        if not GraphStore.exists(store_path):
+            edges = np.array(list(self.g.edges()), dtype=np.int64).reshape(-1, 2).T
+            # self loops are added once
+            reverse = edges[::-1][:, edges[0] != edges[1]]
+            edge_index = np.concatenate([edges, reverse], axis=1)
+            GraphStore.create(store_path, edge_index, np.ones((self.g.number_of_nodes(), 1)))
+        self.store = GraphStore(store_path)
 
     def predict(self, nodes, edges):
         return self.predict_nodes(nodes, edges)
@@ -75,8 +85,21 @@ class BAShapes(BaseExperiment):
             subgraph = self.g.subgraph(subgraph_nodes)
             nodes = [{'feat': 0, 'id': node} for node in subgraph.nodes()]
             edges = [[u, v] for u, v in subgraph.edges()]
-            samples.append({'nodes': nodes, 'edges': edges, 'name': f'3-hop from node {node_idx}'})
+            samples.append({'nodes': nodes, 'edges': edges, 'name': f'3-hop from node {node_idx}', 'center': node_idx})
         return samples
 
+    def graph_store(self):
+        return self.store
+
+    def dataset_size(self):
+        return self.g.number_of_nodes()
+
+    def dataset_item(self, idx):
+        # only the receptive field of the node, the rest of the graph does not change its explanation
+        subset, data, mapping = self.stored_subgraph([idx])
+        nodes = [{'feat': 0, 'id': node} for node in subset.tolist()]
+        edges = [(u, v) for u, v in data.edge_index.T.tolist()]
+        return nodes, edges, int(mapping[0])
+
     def is_directed(self):
         return False
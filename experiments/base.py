@@ -1,45 +1,246 @@
+import inspect
+
+import numpy as np
 import torch
-from torch_geometric.data import Data
-from explainers.node_methods import methods as node_methods
-from explainers.graph_methods import methods as graph_methods
+from torch_geometric.data import Data, Batch
+from torch_geometric.nn import MessagePassing
+from torch_geometric.utils import k_hop_subgraph
+from explainers.node_methods import methods as node_methods, counterfactual as node_counterfactual
+from explainers.node_methods import symmetric_methods as node_symmetric_methods
+from explainers.graph_methods import methods as graph_methods, counterfactual as graph_counterfactual
+from explainers.graph_methods import symmetric_methods as graph_symmetric_methods
+from experiments.inference import optimize_model, quantize_model
+from explainers.fidelity import fidelity_curves
+from metrics import stage
+
+# `torch.inference_mode` is only available on torch>=1.9, `no_grad` gives the same results on older versions
+inference_mode = getattr(torch, 'inference_mode', torch.no_grad)
 
 
 class BaseExperiment:
+    # inference only version of `self.model` used by the predict functions, see `set_inference_backend`
+    inference_model = None
+    inference_backend = 'eager'
+    # undirected experiments explain with a single mask parameter for both directions of each edge
+    symmetric_edge_masks = True
+
     def category_to_tensor(self, category):
         raise NotImplemented
 
     def sample_graphs(self):
         pass
 
+    def sample_graphs_page(self, offset, limit, filters):
+        """
+        Returns a page of the sample graphs matching the filters.
+        Experiments with large datasets should override this and serve pages without building all the samples.
+        :param filters: dictionary with optional `label`, `min_nodes`, `max_nodes` and `categories` keys. The default
+        implementation does not support filtering on the label.
+        :return: (number of matching samples, list of samples in the page)
+        :raises ValueError: if a filter is not supported
+        """
+        if filters.get('label') is not None:
+            raise ValueError(f'experiment {self.name} does not support filtering on the label')
+        samples = self.sample_graphs() or []
+        if filters.get('min_nodes') is not None:
+            samples = [sample for sample in samples if len(sample['nodes']) >= filters['min_nodes']]
+        if filters.get('max_nodes') is not None:
+            samples = [sample for sample in samples if len(sample['nodes']) <= filters['max_nodes']]
+        if filters.get('categories'):
+            required = set(filters['categories'])
+            samples = [sample for sample in samples if required <= {node['feat'] for node in sample['nodes']}]
+        return len(samples), samples[offset:offset + limit]
+
+    def dataset_size(self):
+        """
+        :return: number of items that can be explained offline, see `dataset_item`
+        """
+        raise NotImplementedError
+
+    def dataset_item(self, idx):
+        """
+        :return: a (nodes, edges, node_index) tuple. `edges` are pairs of node indices with both directions included
+        for undirected graphs. `node_index` is the node to explain or None for graph classification. For node
+        classification the graph can be restricted to the receptive field of the node, the `id` of the nodes then
+        refers to the full graph.
+        """
+        raise NotImplementedError
+
     def node_categories(self):
         return [{'text': 'No Category', 'value': 0}]
 
     def predict(self, nodes, edges):
         raise NotImplementedError
 
+    def predict_batch(self, graphs):
+        raise NotImplementedError
+
+    def set_inference_backend(self, backend):
+        """
+        Replaces the model used for predictions with an optimized version, one of `experiments.inference.BACKENDS`.
+        Explanations always use the eager model since they need gradients and edge weights.
+        """
+        self.inference_model, self.inference_backend = optimize_model(self.model, backend, self.example_inputs())
+
+    def enable_quantization(self, min_agreement=1.0):
+        """
+        Serves predictions with a dynamically int8 quantized model if its predictions on the sample graphs agree with
+        the original model on at least `min_agreement` of the predictions
+        :return: True if the quantized model is used
+        """
+        quantized = quantize_model(self.model)
+        agreement = self.prediction_agreement(quantized)
+        if agreement < min_agreement:
+            print(f'Not quantizing {self.name}, only {agreement:.1%} of the predictions on the sample graphs match')
+            return False
+        self.inference_model, self.inference_backend = quantized, 'quantized'
+        return True
+
+    def prediction_agreement(self, model):
+        """
+        :return: fraction of the predictions of `model` on the sample graphs that match `self.model`
+        """
+        matches, total = 0, 0
+        for nodes, edges in self.sample_requests():
+            data = self.make_data(nodes, edges)
+            inputs = [data.x, data.edge_index]
+            if self.is_graph_classification():
+                inputs.append(torch.zeros(data.x.shape[0], dtype=int))
+            with inference_mode():
+                expected = self.model(*inputs).argmax(dim=-1)
+                result = model(*inputs).argmax(dim=-1)
+            matches += (expected == result).sum().item()
+            total += expected.numel()
+        return matches / total if total else 1.0
+
+    def sample_requests(self):
+        """
+        :return: the sample graphs as (nodes, edges) tuples in the format received by `predict` and `explain_*`
+        """
+        graphs = []
+        for sample in self.sample_graphs() or []:
+            node_id_to_index = {node['id']: idx for idx, node in enumerate(sample['nodes'])}
+            edges = [(node_id_to_index[u], node_id_to_index[v]) for u, v in sample['edges']]
+            if not self.is_directed():
+                edges += [(v, u) for u, v in edges]
+            graphs.append((sample['nodes'], edges))
+        return graphs
+
+    def sample_centers(self):
+        """
+        :return: for each graph of `sample_requests`, the index of the node the sample was built around, given by the
+        `center` node id of the sample, or None. The receptive fields of the other nodes can be cut off by the sample.
+        """
+        centers = []
+        for sample in self.sample_graphs() or []:
+            node_ids = [node['id'] for node in sample['nodes']]
+            centers.append(node_ids.index(sample['center']) if sample.get('center') is not None else None)
+        return centers
+
+    def example_inputs(self):
+        categories = [category['value'] for category in self.node_categories()]
+        graphs = []
+        for num_nodes in [5, 9, 7]:
+            nodes = [{'feat': categories[idx % len(categories)]} for idx in range(num_nodes)]
+            edges = [(idx, (idx + 1) % num_nodes) for idx in range(num_nodes)]
+            graphs.append((nodes, edges + [(v, u) for u, v in edges]))
+        if not self.is_graph_classification():
+            data_list = [self.make_data(nodes, edges) for nodes, edges in graphs]
+            return [(data.x, data.edge_index) for data in data_list]
+        single = Batch.from_data_list([self.make_data(*graphs[0])])
+        multiple = Batch.from_data_list([self.make_data(nodes, edges) for nodes, edges in graphs])
+        return [(batch.x, batch.edge_index, batch.batch) for batch in [single, multiple]]
+
+    def inference_forward(self, *inputs):
+        model = self.model if self.inference_model is None else self.inference_model
+        with stage('forward'), inference_mode():
+            return model(*inputs)
+
     def predict_nodes(self, nodes, edges):
         data = self.make_data(nodes, edges)
-        return self.model(data.x, data.edge_index).argmax(dim=1).tolist()
+        return self.inference_forward(data.x, data.edge_index).argmax(dim=1).tolist()
 
     def predict_graph(self, nodes, edges):
         data = self.make_data(nodes, edges)
         batch = torch.zeros(data.x.shape[0], dtype=int)
-        out = self.model(data.x, data.edge_index, batch)[0]
+        out = self.inference_forward(data.x, data.edge_index, batch)[0]
         out = out.argmax(dim=0).tolist()
         return out
 
+    def predict_graphs(self, graphs, batch_size=64, max_nodes=10000):
+        """
+        Predicts many graphs by collating them into batches of at most `batch_size` graphs and `max_nodes` nodes
+        :param graphs: list of (nodes, edges) tuples in the same format accepted by `predict_graph`
+        :return: list of dictionaries with `prediction` and `probabilities` keys, one per graph
+        """
+        results = []
+        for data_list in self.make_batches(graphs, batch_size, max_nodes):
+            batch = Batch.from_data_list(data_list)
+            out = self.inference_forward(batch.x, batch.edge_index, batch.batch)
+            probabilities = out.exp()
+            for pred, probs in zip(out.argmax(dim=1).tolist(), probabilities.tolist()):
+                results.append({'prediction': pred, 'probabilities': probs})
+        return results
+
+    def make_batches(self, graphs, batch_size, max_nodes):
+        data_list = []
+        num_nodes = 0
+        for nodes, edges in graphs:
+            if data_list and (len(data_list) == batch_size or num_nodes + len(nodes) > max_nodes):
+                yield data_list
+                data_list = []
+                num_nodes = 0
+            data_list.append(self.make_data(nodes, edges))
+            num_nodes += len(nodes)
+        if data_list:
+            yield data_list
+
     def make_data(self, nodes, edges):
-        x = torch.stack([self.category_to_tensor(node['feat']) for node in nodes])
-        edge_index = torch.tensor(list(zip(*edges)), dtype=torch.int64)
-        data = Data(x=x, edge_index=edge_index)
+        with stage('make_data'):
+            x = torch.stack([self.category_to_tensor(node['feat']) for node in nodes])
+            edge_index = torch.tensor(list(zip(*edges)), dtype=torch.int64).view(2, -1)
+            data = Data(x=x, edge_index=edge_index)
         return data
 
-    def explain_node(self, nodes, edges, node_id, target, method):
+    def explain_node(self, nodes, edges, node_id, target, method, deadline=None):
+        """
+        :param deadline: optional `explainers.deadline.Deadline`, methods which support it return a partial result
+        when it expires, methods which don't ignore it
+        """
         data = self.make_data(nodes, edges)
-        explain_function = node_methods[method.pop('name')]
-        attributions = explain_function(self.model, node_id, data.x, data.edge_index, target, **method)
+        explain_function = self.explain_function(method.pop('name'))
+        if deadline is not None and 'deadline' in inspect.signature(explain_function).parameters:
+            method['deadline'] = deadline
+        # methods deleting edges delete both directions of undirected edges together
+        if 'undirected' in inspect.signature(explain_function).parameters:
+            method['undirected'] = not self.is_directed()
+        with stage('explain'):
+            attributions = explain_function(self.model, node_id, data.x, data.edge_index, target, **method)
         return attributions
 
+    def counterfactual_node(self, nodes, edges, node_id, target, params):
+        """
+        Searches for a minimal set of edges whose deletion changes the prediction for the node, see
+        `explainers.counterfactual.counterfactual_search` for the format of the result
+        """
+        data = self.make_data(nodes, edges)
+        return node_counterfactual(self.model, node_id, data.x, data.edge_index, target,
+                                   **dict(params, undirected=not self.is_directed()))
+
+    def counterfactual_graph(self, nodes, edges, target, params):
+        data = self.make_data(nodes, edges)
+        return graph_counterfactual(self.model, data.x, data.edge_index, target,
+                                    **dict(params, undirected=not self.is_directed()))
+
+    def evaluate_fidelity(self, nodes, edges, node_index, target, attributions, sparsities=None):
+        """
+        Fidelity curves of an explanation, see `explainers.fidelity.fidelity_curves`
+        :param node_index: the explained node, None for graph classification
+        """
+        data = self.make_data(nodes, edges)
+        return fidelity_curves(self.model, data.x, data.edge_index, attributions, target, node_index,
+                               undirected=not self.is_directed(), num_hops=self.num_hops(), sparsities=sparsities)
+
     def custom_style(self):
         return []
 
@@ -49,12 +250,82 @@ class BaseExperiment:
     def is_graph_classification(self):
         return False
 
-    def explain_graph(self, nodes, edges, target, method):
+    def explain_graph(self, nodes, edges, target, method, deadline=None):
         data = self.make_data(nodes, edges)
-        explain_function = graph_methods[method.pop('name')]
-        attributions = explain_function(self.model, data.x, data.edge_index, target, **method)
+        explain_function = self.explain_function(method.pop('name'))
+        if deadline is not None and 'deadline' in inspect.signature(explain_function).parameters:
+            method['deadline'] = deadline
+        # methods deleting edges delete both directions of undirected edges together
+        if 'undirected' in inspect.signature(explain_function).parameters:
+            method['undirected'] = not self.is_directed()
+        with stage('explain'):
+            attributions = explain_function(self.model, data.x, data.edge_index, target, **method)
         return attributions
 
+    def graph_store(self):
+        """
+        :return: a `GraphStore` if the full graph of this experiment is kept on the server and the client refers to
+        nodes by id, otherwise None
+        """
+        return None
+
+    def num_hops(self):
+        """
+        :return: size of the receptive field of the model, by default the number of message passing layers
+        """
+        return sum(1 for module in self.model.modules() if isinstance(module, MessagePassing))
+
+    def receptive_field_size(self, nodes, edges, node_index):
+        """
+        :return: (number of nodes, number of edges) of the part of the graph the prediction for `node_index` depends
+        on, the whole graph for graph classification
+        """
+        if node_index is None:
+            return len(nodes), len(edges)
+        edge_index = torch.tensor(list(zip(*edges)), dtype=torch.int64).view(2, -1)
+        subset, _, _, edge_mask = k_hop_subgraph(node_index, self.num_hops(), edge_index, num_nodes=len(nodes))
+        return len(subset), int(edge_mask.sum())
+
+    def stored_subgraph(self, node_ids, num_hops=None):
+        """
+        Extracts the receptive field of `node_ids` from the graph store
+        :return: (subset, data, mapping) where `subset` has the global ids of the subgraph nodes and `mapping` is the
+        index of each of `node_ids` in the subgraph
+        """
+        store = self.graph_store()
+        if num_hops is None:
+            num_hops = self.num_hops()
+        subset, edge_index, mapping = store.k_hop_subgraph(node_ids, num_hops)
+        x = torch.from_numpy(np.ascontiguousarray(store.x[subset]))
+        data = Data(x=x, edge_index=torch.from_numpy(edge_index))
+        return subset, data, mapping
+
+    def predict_stored_nodes(self, node_ids):
+        subset, data, mapping = self.stored_subgraph(node_ids)
+        out = self.inference_forward(data.x, data.edge_index)
+        return out.argmax(dim=1)[torch.from_numpy(mapping)].tolist()
+
+    def explain_stored_node(self, node_id, target, method):
+        """
+        :return: (edges, attributions) where `edges` has the global (source, target) ids of the explained edges
+        """
+        subset, data, mapping = self.stored_subgraph([node_id])
+        explain_function = self.explain_function(method.pop('name'))
+        if 'undirected' in inspect.signature(explain_function).parameters:
+            method['undirected'] = not self.is_directed()
+        attributions = explain_function(self.model, int(mapping[0]), data.x, data.edge_index, target, **method)
+        edges = subset[data.edge_index.numpy()].T
+        return edges, attributions
+
+    def explain_function(self, name):
+        if self.is_graph_classification():
+            methods, symmetric_methods = graph_methods, graph_symmetric_methods
+        else:
+            methods, symmetric_methods = node_methods, node_symmetric_methods
+        if self.symmetric_edge_masks and not self.is_directed() and name in symmetric_methods:
+            return symmetric_methods[name]
+        return methods[name]
+
     def get_explain_methods(self):
         if self.is_graph_classification():
             methods = graph_methods
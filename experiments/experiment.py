@@ -52,6 +52,12 @@ class CustomExperiment(BaseExperiment):
         #  This approach is limited to categorical features and will not work for continous features.
         return [{'text': 'No category', 'value': 0}]
 
+    def graph_store(self):
+        # TODO: optional, for node classification on graphs that are too large to send to the client.
+        #  Create a store once with `GraphStore.create` from `experiments.graph_store` and return `GraphStore(path)`.
+        #  The `/stored/*` endpoints then extract the receptive field of the requested nodes on the server.
+        return None
+
     def is_graph_classification(self):
         # TODO: return True or False depending on your model
         raise NotImplementedError
@@ -65,3 +71,9 @@ class CustomExperiment(BaseExperiment):
         # For node classification you can directly return the result of `predict_node` function.
         # For graph classification you must return a dictionary with `prediction` and `text` keys.
         raise NotImplementedError
+
+    def predict_batch(self, graphs):
+        # TODO: optional, only used by the `/predict_batch` endpoint for graph classification.
+        # `graphs` is a list of (nodes, edges) tuples. You can use the `predict_graphs` function implemented in the
+        # base class and add a `text` key to each of its results.
+        raise NotImplementedError
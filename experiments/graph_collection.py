@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+
+class GraphCollection:
+    """
+    A dataset of small graphs stored in memory mapped numpy files, so that any graph can be read without loading the
+    whole dataset. Nodes have a single categorical feature.
+
+    Files in the collection directory:
+    `node_ptr.npy`: int64 array of size num_graphs + 1, nodes of graph i are in [node_ptr[i], node_ptr[i + 1])
+    `edge_ptr.npy`: int64 array of size num_graphs + 1, edges of graph i are in [edge_ptr[i], edge_ptr[i + 1])
+    `categories.npy`: int16 array with the category of each node
+    `edges.npy`: int32 array of shape (num_edges, 2) with node indices local to each graph
+    `labels.npy`: int64 array with the label of each graph
+    `category_masks.npy`: int64 array with a bit set for each category that appears in the graph
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.node_ptr = np.load(os.path.join(path, 'node_ptr.npy'), mmap_mode='r')
+        self.edge_ptr = np.load(os.path.join(path, 'edge_ptr.npy'), mmap_mode='r')
+        self.categories = np.load(os.path.join(path, 'categories.npy'), mmap_mode='r')
+        self.edges = np.load(os.path.join(path, 'edges.npy'), mmap_mode='r')
+        self.labels = np.load(os.path.join(path, 'labels.npy'), mmap_mode='r')
+        self.category_masks = np.load(os.path.join(path, 'category_masks.npy'), mmap_mode='r')
+        self.num_nodes = np.diff(self.node_ptr)
+
+    def __len__(self):
+        return self.labels.shape[0]
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, 'node_ptr.npy'))
+
+    @staticmethod
+    def create(path, graphs):
+        """
+        Writes a collection from an iterable of (categories, edges, label) tuples where `edges` has shape (n, 2). If
+        another process creates the collection at the same time, the first one to finish is kept.
+        """
+        node_ptr, edge_ptr = [0], [0]
+        all_categories, all_edges, labels, category_masks = [], [], [], []
+        for categories, edges, label in graphs:
+            categories = np.asarray(categories, dtype=np.int16)
+            edges = np.asarray(edges, dtype=np.int32).reshape(-1, 2)
+            node_ptr.append(node_ptr[-1] + len(categories))
+            edge_ptr.append(edge_ptr[-1] + len(edges))
+            all_categories.append(categories)
+            all_edges.append(edges)
+            labels.append(label)
+            category_masks.append(np.bitwise_or.reduce(np.left_shift(1, np.unique(categories).astype(np.int64)),
+                                                       initial=0))
+
+        # write to a temporary directory so that readers never see a partially written collection, unique for each
+        # process since several workers may convert the dataset at the same time
+        root = os.path.dirname(os.path.abspath(path))
+        os.makedirs(root, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(dir=root, prefix=os.path.basename(path) + '.tmp')
+        np.save(os.path.join(tmp_path, 'node_ptr.npy'), np.array(node_ptr, dtype=np.int64))
+        np.save(os.path.join(tmp_path, 'edge_ptr.npy'), np.array(edge_ptr, dtype=np.int64))
+        np.save(os.path.join(tmp_path, 'categories.npy'), np.concatenate(all_categories or [np.zeros(0, np.int16)]))
+        np.save(os.path.join(tmp_path, 'edges.npy'), np.concatenate(all_edges or [np.zeros((0, 2), np.int32)]))
+        np.save(os.path.join(tmp_path, 'labels.npy'), np.array(labels, dtype=np.int64))
+        np.save(os.path.join(tmp_path, 'category_masks.npy'), np.array(category_masks, dtype=np.int64))
+        if os.path.exists(path) and not GraphCollection.exists(path):
+            shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # another process moved its identical collection in place first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if not GraphCollection.exists(path):
+                raise
+
+    def graph(self, idx):
+        """
+        :return: (categories, edges, label) of a single graph
+        """
+        categories = self.categories[self.node_ptr[idx]:self.node_ptr[idx + 1]]
+        edges = self.edges[self.edge_ptr[idx]:self.edge_ptr[idx + 1]]
+        return categories, edges, int(self.labels[idx])
+
+    def query(self, label=None, min_nodes=None, max_nodes=None, categories=None):
+        """
+        :param categories: only keep graphs which contain all of these categories
+        :return: sorted indices of the graphs matching all the given filters
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if label is not None:
+            mask &= self.labels == label
+        if min_nodes is not None:
+            mask &= self.num_nodes >= min_nodes
+        if max_nodes is not None:
+            mask &= self.num_nodes <= max_nodes
+        if categories:
+            required = np.bitwise_or.reduce(np.left_shift(1, np.asarray(categories, dtype=np.int64)))
+            mask &= (self.category_masks & required) == required
+        return np.flatnonzero(mask)
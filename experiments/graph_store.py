@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+
+class GraphStore:
+    """
+    A graph kept on the server in memory mapped numpy files, so that huge graphs don't have to be loaded in memory or
+    sent to the client. Edges are stored in CSR form grouped by their target node, which is the index used for
+    extracting the receptive field of nodes.
+
+    Files in the store directory:
+    `indptr.npy`: int64 array of size num_nodes + 1, incoming edges of node i are in [indptr[i], indptr[i + 1])
+    `indices.npy`: int64 array with the source node of each edge
+    `x.npy`: float32 node feature matrix
+    `categories.npy`: int64 array with the category value of each node shown in the UI
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.indptr = np.load(os.path.join(path, 'indptr.npy'), mmap_mode='r')
+        self.indices = np.load(os.path.join(path, 'indices.npy'), mmap_mode='r')
+        self.x = np.load(os.path.join(path, 'x.npy'), mmap_mode='r')
+        self.categories = np.load(os.path.join(path, 'categories.npy'), mmap_mode='r')
+
+    @property
+    def num_nodes(self):
+        return self.indptr.shape[0] - 1
+
+    @property
+    def num_edges(self):
+        return self.indices.shape[0]
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, 'indptr.npy'))
+
+    @staticmethod
+    def create(path, edge_index, x, categories=None):
+        """
+        Writes a graph store from an edge index with shape (2, num_edges) and a node feature matrix. If another process
+        creates the store at the same time, the first one to finish is kept.
+        """
+        edge_index = np.asarray(edge_index, dtype=np.int64)
+        num_nodes = x.shape[0]
+        order = np.lexsort((edge_index[0], edge_index[1]))
+        targets = edge_index[1, order]
+        indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(targets, minlength=num_nodes), out=indptr[1:])
+        if categories is None:
+            categories = np.zeros(num_nodes, dtype=np.int64)
+
+        # write to a temporary directory so that readers never see a partially written store, unique for each process
+        # since several workers may create the store at the same time
+        root = os.path.dirname(os.path.abspath(path))
+        os.makedirs(root, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(dir=root, prefix=os.path.basename(path) + '.tmp')
+        np.save(os.path.join(tmp_path, 'indptr.npy'), indptr)
+        np.save(os.path.join(tmp_path, 'indices.npy'), edge_index[0, order])
+        np.save(os.path.join(tmp_path, 'x.npy'), np.asarray(x, dtype=np.float32))
+        np.save(os.path.join(tmp_path, 'categories.npy'), np.asarray(categories, dtype=np.int64))
+        if os.path.exists(path) and not GraphStore.exists(path):
+            shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # another process moved its identical store in place first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if not GraphStore.exists(path):
+                raise
+
+    def incoming_edges(self, nodes):
+        """
+        :return: (sources, targets) arrays of all the edges pointing to `nodes`
+        """
+        starts = self.indptr[nodes]
+        counts = self.indptr[nodes + 1] - starts
+        # positions of all edges of all nodes without a python loop over the nodes
+        positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        return self.indices[positions], np.repeat(nodes, counts)
+
+    def k_hop_subgraph(self, node_ids, num_hops):
+        """
+        Extracts the nodes which can reach `node_ids` in at most `num_hops` steps and the edges between them
+        :return: (subset, edge_index, mapping) where `subset` is the sorted array of global node ids, `edge_index` uses
+        positions in `subset` and `mapping` is the position of each of `node_ids` in `subset`
+        """
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        subset = np.unique(node_ids)
+        frontier = subset
+        for _ in range(num_hops):
+            sources, _ = self.incoming_edges(frontier)
+            frontier = np.setdiff1d(sources, subset)
+            if len(frontier) == 0:
+                break
+            subset = np.union1d(subset, frontier)
+        sources, targets = self.incoming_edges(subset)
+        mask = np.isin(sources, subset)
+        edge_index = np.stack([np.searchsorted(subset, sources[mask]), np.searchsorted(subset, targets[mask])])
+        return subset, edge_index, np.searchsorted(subset, node_ids)
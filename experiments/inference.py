@@ -0,0 +1,97 @@
+import copy
+import io
+
+import torch
+
+BACKENDS = ['eager', 'compile', 'torchscript', 'onnx']
+
+
+class OnnxModel:
+    """
+    Runs an exported model with onnxruntime, called like the torch model it was exported from
+    """
+
+    def __init__(self, model, example_inputs):
+        import onnxruntime
+
+        self.input_names = [f'input_{idx}' for idx in range(len(example_inputs))]
+        dynamic_axes = {name: {0: 'rows'} if tensor.dim() == 1 else {0: 'rows', 1: 'columns'}
+                        for name, tensor in zip(self.input_names, example_inputs)}
+        dynamic_axes['output'] = {0: 'rows'}
+        buffer = io.BytesIO()
+        torch.onnx.export(model, tuple(example_inputs), buffer, input_names=self.input_names,
+                          output_names=['output'], dynamic_axes=dynamic_axes)
+        self.session = onnxruntime.InferenceSession(buffer.getvalue(), providers=['CPUExecutionProvider'])
+
+    def __call__(self, *inputs):
+        feeds = {name: tensor.cpu().numpy() for name, tensor in zip(self.input_names, inputs)}
+        return torch.from_numpy(self.session.run(None, feeds)[0])
+
+
+def quantize_model(model):
+    """
+    Dynamic int8 quantization of all the linear layers, including the ones inside the graph convolutions.
+    Activations are quantized on the fly, so no calibration data is needed. The original model is not modified.
+    """
+    model = copy.deepcopy(model)
+    replace_linear_layers(model)
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def replace_linear_layers(module):
+    """
+    Newer versions of torch_geometric use their own `Linear` class inside the convolutions which is not known to the
+    quantization functions, this replaces them with equivalent `torch.nn.Linear` layers in place
+    """
+    for name, child in module.named_children():
+        if type(child).__name__ == 'Linear' and not isinstance(child, torch.nn.Linear):
+            linear = torch.nn.Linear(child.in_channels, child.out_channels, bias=child.bias is not None)
+            linear.load_state_dict(child.state_dict())
+            setattr(module, name, linear)
+        else:
+            replace_linear_layers(child)
+
+
+def model_size(model):
+    """
+    :return: size of the serialized parameters of the model in bytes
+    """
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes
+
+
+def build_inference_model(model, backend, example_inputs):
+    if backend == 'eager':
+        return model
+    if backend == 'compile':
+        return torch.compile(model, dynamic=True)
+    if backend == 'torchscript':
+        with torch.no_grad():
+            return torch.jit.freeze(torch.jit.trace(model, tuple(example_inputs[0]), check_trace=False))
+    if backend == 'onnx':
+        return OnnxModel(model, example_inputs[0])
+    raise ValueError(f'Unknown inference backend {backend}, supported backends are {BACKENDS}')
+
+
+def optimize_model(model, backend, example_inputs, atol=1e-4):
+    """
+    Builds an inference only version of `model` with the given backend. The result is checked against the eager model
+    on all `example_inputs`, the eager model is returned if the export fails or gives different results.
+    Exported models often specialize on the shapes of the first example, so examples should have different sizes.
+    :return: (model, name of the backend actually used)
+    """
+    try:
+        optimized = build_inference_model(model, backend, example_inputs)
+        with torch.no_grad():
+            for inputs in example_inputs:
+                expected = model(*inputs)
+                result = optimized(*inputs)
+                if result.shape != expected.shape or not torch.allclose(result, expected, atol=atol):
+                    raise RuntimeError('results differ from the eager model')
+    except Exception as e:
+        # errors of the exporters usually end with the relevant line after a long trace
+        message = str(e).strip().splitlines()[-1] if str(e).strip() else repr(e)
+        print(f'Falling back to eager inference, {backend} backend failed: {message}')
+        return model, 'eager'
+    return optimized, backend
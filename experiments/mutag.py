@@ -5,6 +5,7 @@ from torch_geometric.datasets import TUDataset
 from torch_geometric.nn import global_add_pool, GraphConv
 
 from experiments.base import BaseExperiment
+from experiments.graph_collection import GraphCollection
 
 
 class Net(torch.nn.Module):
@@ -47,26 +48,49 @@ class Mutag(BaseExperiment):
         model.load_state_dict(torch.load('experiments/mutag.pt'))
         model.eval()
         self.model = model
+        self.dataset = None
 
     def category_to_tensor(self, category):
         result = [0] * 14
         result[category] = 1
         return torch.tensor(result).float()
 
+    def load_dataset(self):
+        if self.dataset is None:
+            path = 'graph_store/Mutagenicity'
+            if not GraphCollection.exists(path):
+                # one time conversion of the dataset to a memory mapped collection shared by all the workers
+                dataset = TUDataset('.', name='Mutagenicity')
+                GraphCollection.create(path, ((data.x.argmax(dim=1).numpy(),
+                                               [[u, v] for u, v in data.edge_index.t().tolist() if u < v],
+                                               data.y.item()) for data in dataset))
+            self.dataset = GraphCollection(path)
+        return self.dataset
+
+    def make_sample(self, sample_id):
+        feats, edges, label = self.load_dataset().graph(sample_id)
+        nodes = [{'feat': f, 'id': idx, 'name': ATOM_MAP[f]} for idx, f in enumerate(feats.tolist())]
+        return {'nodes': nodes,
+                'edges': edges.tolist(),  # one direction of each edge is enough for front-end
+                'name': f'#{sample_id}: {self.label_text(label)}',
+                'label': self.label_text(label)}
+
     def sample_graphs(self):
-        path = '.'
-        dataset = TUDataset(path, name='Mutagenicity')[:50]
-        samples = []
-        for sample_id, data in enumerate(dataset):
-            edges = list(zip(*data.edge_index.tolist()))
-            edges = [[u, v] for u, v in edges if u < v]  # one direction of each edge is enough for front-end
-            feats = data.x.argmax(dim=1).tolist()
-            nodes = [{'feat': f, 'id': idx, 'name': ATOM_MAP[f]} for idx, f in enumerate(feats)]
-            samples.append({'nodes': nodes,
-                            'edges': edges,
-                            'name': f'#{sample_id}: {self.label_text(data.y.item())}',
-                            'label': self.label_text(data.y.item())})
-        return samples
+        return [self.make_sample(sample_id) for sample_id in range(min(50, len(self.load_dataset())))]
+
+    def sample_graphs_page(self, offset, limit, filters):
+        indices = self.load_dataset().query(**filters)
+        return len(indices), [self.make_sample(sample_id) for sample_id in indices[offset:offset + limit].tolist()]
+
+    def dataset_size(self):
+        return len(self.load_dataset())
+
+    def dataset_item(self, idx):
+        feats, edges, label = self.load_dataset().graph(idx)
+        nodes = [{'feat': f, 'id': node_idx, 'name': ATOM_MAP[f]} for node_idx, f in enumerate(feats.tolist())]
+        edges = edges.tolist()
+        edges = [(u, v) for u, v in edges] + [(v, u) for u, v in edges]
+        return nodes, edges, None
 
     def node_categories(self):
         return [{'text': text, 'value': idx} for idx, text in enumerate(ATOM_MAP)]
@@ -83,6 +107,12 @@ class Mutag(BaseExperiment):
         text = self.label_text(pred)
         return {'prediction': pred, 'text': text}
 
+    def predict_batch(self, graphs):
+        results = self.predict_graphs(graphs)
+        for result in results:
+            result['text'] = self.label_text(result['prediction'])
+        return results
+
     def is_directed(self):
         return False
 
@@ -0,0 +1,177 @@
+# Computes explanations for a whole dataset outside the web UI.
+# Example: python explain_dataset.py Mutag --methods sa ig occlusion --start 0 --end 1000 --workers 4 --output out/
+#
+# Items are split into shards of `--shard-size` consecutive items. Every shard is a directory containing:
+#   `offsets.npy`:  int64 array of size n+1, attributions of the i-th item are in [offsets[i], offsets[i + 1])
+#   `edges.npy`:    int32 array of shape (total_edges, 2) with the (source, target) node ids of each edge, for node
+#                   classification the ids of the full graph even if the item is restricted to a receptive field
+#   `targets.npy`:  int64 array with the explained class of each item
+#   `<method>.npy`: float32 array with the attributions of all items of the shard for one method
+# `index.json` in the output directory lists the finished shards and is used to resume an interrupted run.
+# All arrays can be opened with `np.load(path, mmap_mode='r')`, see `load_attributions`.
+
+import argparse
+import json
+import os
+import shutil
+import time
+from multiprocessing import Pool
+
+import numpy as np
+import torch
+
+from experiments.base import BaseExperiment
+# noinspection PyUnresolvedReferences
+from experiments import *
+
+INDEX_FILE = 'index.json'
+
+experiment = None
+
+
+def find_experiment_class(name):
+    for cls in BaseExperiment.__subclasses__():
+        if cls.name == name:
+            return cls
+    raise ValueError(f'Unknown experiment {name}')
+
+
+def init_worker(experiment_name, num_threads):
+    global experiment
+    torch.set_num_threads(num_threads)
+    experiment = find_experiment_class(experiment_name)()
+
+
+def predicted_target(nodes, edges, node_index):
+    if node_index is None:
+        return experiment.predict_graph(nodes, edges)
+    return experiment.predict_nodes(nodes, edges)[node_index]
+
+
+def explain_item(nodes, edges, node_index, target, method):
+    method = {'name': method}
+    if node_index is None:
+        return experiment.explain_graph(nodes, edges, target, method)
+    return experiment.explain_node(nodes, edges, node_index, target, method)
+
+
+def explain_shard(args):
+    shard_id, items, methods, target, output = args
+    start = time.perf_counter()
+    offsets = [0]
+    edges = []
+    targets = []
+    attributions = {method: [] for method in methods}
+    for idx in items:
+        nodes, item_edges, node_index = experiment.dataset_item(idx)
+        item_target = predicted_target(nodes, item_edges, node_index) if target is None else target
+        for method in methods:
+            attributions[method].append(np.asarray(explain_item(nodes, item_edges, node_index, item_target, method),
+                                                   dtype=np.float32))
+        offsets.append(offsets[-1] + len(item_edges))
+        node_ids = [node['id'] for node in nodes]
+        edges.extend((node_ids[u], node_ids[v]) for u, v in item_edges)
+        targets.append(item_target)
+
+    # write to a temporary directory first so that a crash never leaves a partially written shard behind
+    shard_dir = os.path.join(output, shard_name(shard_id))
+    tmp_dir = shard_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    np.save(os.path.join(tmp_dir, 'offsets.npy'), np.array(offsets, dtype=np.int64))
+    np.save(os.path.join(tmp_dir, 'edges.npy'), np.array(edges, dtype=np.int32).reshape(-1, 2))
+    np.save(os.path.join(tmp_dir, 'targets.npy'), np.array(targets, dtype=np.int64))
+    for method, values in attributions.items():
+        np.save(os.path.join(tmp_dir, f'{method}.npy'), np.concatenate(values) if values else np.zeros(0, np.float32))
+    shutil.rmtree(shard_dir, ignore_errors=True)
+    os.rename(tmp_dir, shard_dir)
+    return shard_id, len(items), time.perf_counter() - start
+
+
+def shard_name(shard_id):
+    return f'shard_{shard_id:05d}'
+
+
+def load_index(output, experiment_name, methods, start, end, shard_size, target):
+    config = {'experiment': experiment_name, 'methods': methods, 'start': start, 'end': end,
+              'shard_size': shard_size, 'target': target}
+    path = os.path.join(output, INDEX_FILE)
+    if not os.path.exists(path):
+        return dict(config, shards={})
+    with open(path) as f:
+        index = json.load(f)
+    for key, value in config.items():
+        if index[key] != value:
+            raise ValueError(f'{path} was created with {key}={index[key]}, can not resume with {key}={value}')
+    return index
+
+
+def save_index(output, index):
+    path = os.path.join(output, INDEX_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def load_attributions(output, item, method):
+    """
+    Reads the attributions of a single item from the output of a finished or interrupted run
+    :return: (edges, attributions) arrays, both memory mapped, the edges are pairs of node ids
+    """
+    with open(os.path.join(output, INDEX_FILE)) as f:
+        index = json.load(f)
+    shard_id = (item - index['start']) // index['shard_size']
+    if str(shard_id) not in index['shards']:
+        raise KeyError(f'item {item} has not been explained yet')
+    shard_dir = os.path.join(output, shard_name(shard_id))
+    position = (item - index['start']) % index['shard_size']
+    offsets = np.load(os.path.join(shard_dir, 'offsets.npy'), mmap_mode='r')
+    begin, end = offsets[position], offsets[position + 1]
+    edges = np.load(os.path.join(shard_dir, 'edges.npy'), mmap_mode='r')[begin:end]
+    attributions = np.load(os.path.join(shard_dir, f'{method}.npy'), mmap_mode='r')[begin:end]
+    return edges, attributions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Explains a range of dataset items with several methods')
+    parser.add_argument('experiment', help='name of the experiment, e.g. Mutag or BAShapes')
+    parser.add_argument('--methods', nargs='+', required=True)
+    parser.add_argument('--start', type=int, default=0)
+    parser.add_argument('--end', type=int, default=None, help='exclusive, defaults to the size of the dataset')
+    parser.add_argument('--target', type=int, default=None, help='explained class, defaults to the model prediction')
+    parser.add_argument('--output', required=True)
+    parser.add_argument('--shard-size', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--threads-per-worker', type=int, default=1)
+    args = parser.parse_args()
+
+    experiment_class = find_experiment_class(args.experiment)
+    end = args.end
+    if end is None:
+        end = experiment_class().dataset_size()
+    os.makedirs(args.output, exist_ok=True)
+    index = load_index(args.output, args.experiment, args.methods, args.start, end, args.shard_size, args.target)
+
+    tasks = []
+    for shard_id, shard_start in enumerate(range(args.start, end, args.shard_size)):
+        if str(shard_id) in index['shards']:
+            continue
+        items = list(range(shard_start, min(shard_start + args.shard_size, end)))
+        tasks.append((shard_id, items, args.methods, args.target, args.output))
+    remaining = sum(len(task[1]) for task in tasks)
+    print(f'{len(index["shards"])} shards already done, explaining {remaining} items in {len(tasks)} shards')
+
+    start = time.perf_counter()
+    done = 0
+    with Pool(args.workers, initializer=init_worker, initargs=(args.experiment, args.threads_per_worker)) as pool:
+        for shard_id, num_items, elapsed in pool.imap_unordered(explain_shard, tasks):
+            index['shards'][str(shard_id)] = {'items': num_items, 'seconds': elapsed}
+            save_index(args.output, index)
+            done += num_items
+            total_elapsed = time.perf_counter() - start
+            print(f'shard {shard_id} done: {num_items / elapsed:.2f} items/s in worker, '
+                  f'{done}/{remaining} items, {done / total_elapsed:.2f} items/s overall', flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+import numpy as np
+import torch
+
+
+def masked_forward(model, x, edge_index, edge_masks, node_idx=None, max_batch_size=256):
+    """
+    Runs the model on many copies of the same graph with different edges removed, using one forward per
+    `max_batch_size` copies instead of one forward per copy.
+    :param edge_masks: boolean array of shape (number of copies, number of edges), True for the kept edges
+    :param node_idx: the explained node for node classification, None for graph classification
+    :return: model output for `node_idx` (or the graph) in each copy, shape (number of copies, number of classes)
+    """
+    edge_masks = torch.as_tensor(np.asarray(edge_masks, dtype=bool))
+    outputs = []
+    with torch.no_grad():
+        for start in range(0, edge_masks.shape[0], max_batch_size):
+            masks = edge_masks[start:start + max_batch_size]
+            outputs.append(batch_forward(model, x, edge_index, masks, node_idx))
+    if not outputs:
+        return torch.zeros(0)
+    return torch.cat(outputs)
+
+
+def batch_forward(model, x, edge_index, edge_masks, node_idx=None):
+    num_copies, num_edges = edge_masks.shape
+    num_nodes = x.shape[0]
+    offsets = torch.arange(num_copies) * num_nodes
+    # disjoint union of all the copies, node ids of copy i are shifted by i * num_nodes
+    batch_edge_index = edge_index.repeat(1, num_copies) + offsets.repeat_interleave(num_edges)
+    batch_edge_index = batch_edge_index[:, edge_masks.reshape(-1)]
+    batch_x = x.repeat(num_copies, 1)
+    if node_idx is None:
+        batch = torch.arange(num_copies).repeat_interleave(num_nodes)
+        return model(batch_x, batch_edge_index, batch)
+    return model(batch_x, batch_edge_index)[offsets + node_idx]
+
+
+def removal_masks(num_edges, removed_groups):
+    """
+    :param removed_groups: list of arrays of edge indices, one for each copy of the graph
+    :return: boolean masks of the kept edges for `masked_forward`
+    """
+    masks = np.ones((len(removed_groups), num_edges), dtype=bool)
+    for idx, group in enumerate(removed_groups):
+        masks[idx, group] = False
+    return masks
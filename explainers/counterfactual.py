@@ -0,0 +1,66 @@
+import time
+
+import numpy as np
+
+
+def undirected_groups(edge_index, edges):
+    """
+    Groups the two directions of each edge so that they are deleted together, returns a list of arrays of edge ids
+    """
+    edge_index = edge_index.cpu().numpy()
+    groups = {}
+    for edge in edges.tolist():
+        u, v = edge_index[:, edge].tolist()
+        groups.setdefault((min(u, v), max(u, v)), []).append(edge)
+    return [np.array(group) for group in groups.values()]
+
+
+def counterfactual_search(evaluate, candidates, scores, target, beam_width=5, max_deletions=10,
+                          max_candidates=50, time_budget=2.0):
+    """
+    Beam search for a minimal set of edge deletions that changes the prediction. If `target` is the predicted class
+    the prediction has to change to any other class, otherwise it has to change to `target`.
+    All the expansions of a search step are scored with a single call of `evaluate`.
+    :param evaluate: function that takes a list of arrays of deleted edges and returns log probabilities of shape
+    (number of deletion sets, number of classes)
+    :param candidates: list of arrays of edges which are deleted together
+    :param scores: gradient of the target output with respect to each candidate, used to try the deletions that
+    reduce (or increase) the target the most first
+    :return: dictionary with the deleted edges, whether the prediction changed, the new prediction and the number of
+    forwards and evaluated deletion sets. If the prediction did not change within the limits, the best deletion set
+    found so far is returned.
+    """
+    start = time.perf_counter()
+    predicted = int(np.asarray(evaluate([np.array([], dtype=int)])).argmax(axis=1)[0])
+    away = target == predicted
+    scores = np.asarray(scores) if away else -np.asarray(scores)
+    order = np.argsort(-scores)[:max_candidates]
+    candidates = [candidates[idx] for idx in order]
+    result = {'edges': [], 'flipped': False, 'prediction': predicted, 'num_forwards': 1, 'num_evaluations': 1}
+    beam = [()]
+    best_objective = None
+    for _ in range(min(max_deletions, len(candidates))):
+        expansions = sorted({tuple(sorted(state + (idx,))) for state in beam for idx in range(len(candidates))
+                             if idx not in state})
+        if not expansions:
+            break
+        removed = [np.concatenate([candidates[idx] for idx in state]) for state in expansions]
+        log_probs = np.asarray(evaluate(removed))
+        result['num_forwards'] += 1
+        result['num_evaluations'] += len(expansions)
+        predictions = log_probs.argmax(axis=1)
+        # lower is better, the probability of the target when moving away from it and its negation otherwise
+        objective = log_probs[:, target] if away else -log_probs[:, target]
+        flipped = predictions != target if away else predictions == target
+        if flipped.any():
+            best = np.flatnonzero(flipped)[np.argmin(objective[flipped])]
+            result.update(flipped=True, prediction=int(predictions[best]), edges=removed[best].tolist())
+            return result
+        ranking = np.argsort(objective)[:beam_width]
+        beam = [expansions[idx] for idx in ranking]
+        if best_objective is None or objective[ranking[0]] < best_objective:
+            best_objective = objective[ranking[0]]
+            result.update(prediction=int(predictions[ranking[0]]), edges=removed[ranking[0]].tolist())
+        if time.perf_counter() - start > time_budget:
+            break
+    return result
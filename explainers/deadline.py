@@ -0,0 +1,54 @@
+import time
+
+
+class Deadline:
+    """
+    Time budget of an explanation. Methods which support it take a `deadline` argument, do as much work as fits in
+    the budget and call `stop` when they return a partial result.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.end = time.perf_counter() + seconds
+        self.stopped_early = False
+
+    def remaining(self):
+        return self.end - time.perf_counter()
+
+    def expired(self, reserve=0.0):
+        """
+        :param reserve: fraction of the budget kept for the work done after the iterations, e.g. the statistical tests
+        of PGMExplainer
+        """
+        return self.remaining() <= reserve * self.seconds
+
+    def stop(self):
+        self.stopped_early = True
+
+
+def deadline_expired(deadline, reserve=0.0):
+    """
+    :return: True and marks the explanation as stopped early if there is a deadline and it expired
+    """
+    if deadline is not None and deadline.expired(reserve):
+        deadline.stop()
+        return True
+    return False
+
+
+def scale_iterations(deadline, iterations, run_iteration, minimum=2):
+    """
+    Reduces the number of iterations of a method whose iterations all run in one call (e.g. the steps of integrated
+    gradients) so that they fit in the remaining time
+    :param run_iteration: function taking as long as one iteration, it is timed once if there is a deadline
+    """
+    if deadline is None:
+        return iterations
+    start = time.perf_counter()
+    run_iteration()
+    iteration_time = max(time.perf_counter() - start, 1e-6)
+    affordable = max(minimum, int(deadline.remaining() / iteration_time))
+    if affordable < iterations:
+        deadline.stop()
+        return affordable
+    return iterations
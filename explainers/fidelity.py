@@ -0,0 +1,50 @@
+import numpy as np
+from torch_geometric.utils import k_hop_subgraph
+
+from explainers.batched import masked_forward
+from explainers.counterfactual import undirected_groups
+
+DEFAULT_SPARSITIES = [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]
+
+
+def fidelity_curves(model, x, edge_index, attributions, target, node_idx=None, undirected=False, num_hops=None,
+                    sparsities=None):
+    """
+    Measures how faithful an explanation is at several sparsity levels with a single batched evaluation.
+    At sparsity s the k = (1 - s) * E most important edges are selected, where E is the number of edges in the
+    receptive field (node classification) or in the graph (graph classification).
+    fidelity+ is the drop of the target probability when the k edges are removed,
+    fidelity- is the drop of the target probability when only the k edges are kept.
+    :param attributions: edge attributions of any explanation method, higher is more important
+    :param undirected: both directions of each edge are ranked by the sum of their attributions and kept or removed
+    together
+    :return: dictionary with the `sparsity`, `k`, `fidelity_plus` and `fidelity_minus` lists and the `probability`
+    of the target on the full graph
+    """
+    if sparsities is None:
+        sparsities = DEFAULT_SPARSITIES
+    attributions = np.asarray(attributions)
+    if node_idx is not None:
+        subset, edge_index_sub, mapping, hard_edge_mask = k_hop_subgraph(node_idx, num_hops, edge_index,
+                                                                        relabel_nodes=True, num_nodes=x.shape[0])
+        attributions = attributions[hard_edge_mask.cpu().numpy()]
+        x, edge_index, node_idx = x[subset], edge_index_sub, int(mapping[0])
+    num_edges = edge_index.shape[1]
+    edges = np.arange(num_edges)
+    groups = undirected_groups(edge_index, edges) if undirected else [edges[[idx]] for idx in edges]
+    order = np.argsort([-attributions[group].sum() for group in groups], kind='stable')
+    ks = [int(round((1 - sparsity) * len(groups))) for sparsity in sparsities]
+
+    masks = np.ones((1 + 2 * len(ks), num_edges), dtype=bool)
+    for idx, k in enumerate(ks):
+        selected = np.concatenate([groups[group] for group in order[:k]] + [np.zeros(0, dtype=int)])
+        masks[1 + 2 * idx, selected] = False  # top-k removed
+        masks[2 + 2 * idx] = False
+        masks[2 + 2 * idx, selected] = True  # only top-k kept
+    probabilities = masked_forward(model, x, edge_index, masks, node_idx)[:, target].exp().numpy()
+    full = probabilities[0]
+    return {'sparsity': list(sparsities),
+            'k': ks,
+            'fidelity_plus': (full - probabilities[1::2]).tolist(),
+            'fidelity_minus': (full - probabilities[2::2]).tolist(),
+            'probability': float(full)}
@@ -1,7 +1,11 @@
+import math
+
 import torch
 from torch_geometric.nn import GNNExplainer
 from tqdm import tqdm
 
+from explainers.deadline import deadline_expired
+
 EPS = 1e-15
 
 
@@ -21,7 +25,7 @@ class TargetedGNNExplainer(GNNExplainer):
 
         return loss
 
-    def explain_node_with_target(self, node_idx, x, edge_index, target_class, **kwargs):
+    def explain_node_with_target(self, node_idx, x, edge_index, target_class, deadline=None, **kwargs):
         r"""Learns and returns a node feature mask and an edge mask that play a
         crucial role to explain the prediction made by the GNN for node
         :attr:`node_idx`.
@@ -30,6 +34,7 @@ class TargetedGNNExplainer(GNNExplainer):
             node_idx (int): The node to explain.
             x (Tensor): The node feature matrix.
             edge_index (LongTensor): The edge indices.
+            deadline (Deadline, optional): Stops training when it expires.
             **kwargs (optional): Additional arguments passed to the GNN module.
 
         :rtype: (:class:`Tensor`, :class:`Tensor`)
@@ -62,6 +67,8 @@ class TargetedGNNExplainer(GNNExplainer):
             pbar.set_description(f'Explain node {node_idx}')
 
         for epoch in range(1, self.epochs + 1):
+            if epoch > 1 and deadline_expired(deadline):
+                break
             optimizer.zero_grad()
             h = x * self.node_feat_mask.view(1, -1).sigmoid()
             log_logits = self.model(x=h, edge_index=edge_index, **kwargs)
@@ -100,7 +107,7 @@ class TargetedGNNExplainerGraph(GNNExplainer):
 
         return loss
 
-    def explain_with_target(self, x, edge_index, target_class, **kwargs):
+    def explain_with_target(self, x, edge_index, target_class, deadline=None, **kwargs):
         r"""Learns and returns a node feature mask and an edge mask that play a
         crucial role to explain the prediction made by the GNN for node
         :attr:`node_idx`.
@@ -109,6 +116,7 @@ class TargetedGNNExplainerGraph(GNNExplainer):
             node_idx (int): The node to explain.
             x (Tensor): The node feature matrix.
             edge_index (LongTensor): The edge indices.
+            deadline (Deadline, optional): Stops training when it expires.
             **kwargs (optional): Additional arguments passed to the GNN module.
 
         :rtype: (:class:`Tensor`, :class:`Tensor`)
@@ -135,6 +143,8 @@ class TargetedGNNExplainerGraph(GNNExplainer):
             pbar.set_description('Explain graph')
 
         for epoch in range(1, self.epochs + 1):
+            if epoch > 1 and deadline_expired(deadline):
+                break
             optimizer.zero_grad()
             h = x * self.node_feat_mask.view(1, -1).sigmoid()
             log_logits = self.model(x=h, edge_index=edge_index, **kwargs)
@@ -154,3 +164,63 @@ class TargetedGNNExplainerGraph(GNNExplainer):
         self.__clear_masks__()
 
         return node_feat_mask, edge_mask
+
+
+class SymmetricGNNExplainer:
+    """
+    GNNExplainer for undirected graphs with a single mask parameter for both directions of each edge. The masks are
+    passed to the model as edge weights, which halves the number of learned edge parameters.
+    """
+    coeffs = {
+        'edge_size': 0.005,
+        'node_feat_size': 1.0,
+        'edge_ent': 1.0,
+        'node_feat_ent': 0.1,
+    }
+
+    def __init__(self, model, epochs=100, lr=0.01):
+        self.model = model
+        self.epochs = epochs
+        self.lr = lr
+        self.coeffs = dict(self.coeffs)
+
+    def __loss__(self, log_probs, target_class, edge_mask, node_feat_mask):
+        loss = -log_probs[target_class]
+
+        m = edge_mask.sigmoid()
+        loss = loss + self.coeffs['edge_size'] * m.sum()
+        ent = -m * torch.log(m + EPS) - (1 - m) * torch.log(1 - m + EPS)
+        loss = loss + self.coeffs['edge_ent'] * ent.mean()
+
+        m = node_feat_mask.sigmoid()
+        loss = loss + self.coeffs['node_feat_size'] * m.sum()
+        ent = -m * torch.log(m + EPS) - (1 - m) * torch.log(1 - m + EPS)
+        loss = loss + self.coeffs['node_feat_ent'] * ent.mean()
+
+        return loss
+
+    def explain_with_target(self, forward, x, pairs, num_pairs, target_class, deadline=None):
+        """
+        :param forward: function that takes the masked node features and the edge weights and returns the log
+        probabilities for the explained node or graph
+        :param pairs: parameter id of each directed edge, see `explainers.symmetric.edge_pairs`
+        :param deadline: optional `explainers.deadline.Deadline`, training stops when it expires
+        :return: (node feature mask, edge mask of each undirected edge)
+        """
+        self.model.eval()
+        std = torch.nn.init.calculate_gain('relu') * math.sqrt(2.0 / (2 * x.shape[0]))
+        node_feat_mask = torch.nn.Parameter(torch.randn(x.shape[1], device=x.device) * 0.1)
+        edge_mask = torch.nn.Parameter(torch.randn(num_pairs, device=x.device) * std)
+        optimizer = torch.optim.Adam([node_feat_mask, edge_mask], lr=self.lr)
+
+        for epoch in range(1, self.epochs + 1):
+            if epoch > 1 and deadline_expired(deadline):
+                break
+            optimizer.zero_grad()
+            h = x * node_feat_mask.view(1, -1).sigmoid()
+            log_probs = forward(h, edge_mask.sigmoid()[pairs])
+            loss = self.__loss__(log_probs, target_class, edge_mask, node_feat_mask)
+            loss.backward()
+            optimizer.step()
+
+        return node_feat_mask.detach().sigmoid(), edge_mask.detach().sigmoid()
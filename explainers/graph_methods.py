@@ -21,9 +21,20 @@ from torch_geometric.data import Data
 from torch_geometric.nn import MessagePassing
 from torch_geometric.utils import to_networkx
 
-from explainers.gnn_explainer import TargetedGNNExplainerGraph
+from explainers.gnn_explainer import TargetedGNNExplainerGraph, SymmetricGNNExplainer
+from explainers.sparse_graph import pagerank_attributions
+from explainers.batched import masked_forward, removal_masks
+from explainers.group_occlusion import hierarchical_occlusion, ring_groups, sort_edges
+from explainers.shapley import shapley_values
+from explainers.counterfactual import counterfactual_search, undirected_groups
+from explainers.symmetric import edge_pairs, split_to_edges
+from explainers.deadline import scale_iterations
 
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+# limits of the iterations of the methods, a deadline can only lower the work further
+MAX_EPOCHS = 600
+MAX_SHAPLEY_SAMPLES = 1024
+MAX_STEPS = 200
 
 
 class GraphLayerGradCam(LayerGradCam):
@@ -73,6 +84,10 @@ def model_forward(edge_mask, model, x, edge_index):
     return out
 
 
+def model_forward_symmetric(pair_mask, model, x, edge_index, pairs):
+    return model_forward(pair_mask[pairs], model, x, edge_index)
+
+
 def model_forward_node(x, model, edge_index):
     batch = torch.zeros(x.shape[0], dtype=int)
     out = model(x, edge_index, batch)
@@ -115,15 +130,7 @@ def explain_random(model, x, edge_index, target, include_edges=None):
 
 
 def explain_pagerank(model, x, edge_index, target, include_edges=None):
-    data = Data(x=x, edge_index=edge_index)
-    g = to_networkx(data)
-    pagerank = nx.pagerank(g)
-
-    node_attr = np.zeros(x.shape[0])
-    for node, value in pagerank.items():
-        node_attr[node] = value
-    edge_mask = node_attr_to_edge(edge_index, node_attr)
-    return edge_mask
+    return pagerank_attributions(edge_index, x.shape[0])[0]
 
 
 def explain_sa_node(model, x, edge_index, target, include_edges=None):
@@ -147,6 +154,16 @@ def explain_sa(model, x, edge_index, target, include_edges=None):
     return edge_mask
 
 
+def explain_sa_symmetric(model, x, edge_index, target, include_edges=None):
+    pairs, num_pairs = edge_pairs(edge_index, x.shape[0])
+    saliency = Saliency(model_forward_symmetric)
+    input_mask = torch.ones(num_pairs).requires_grad_(True).to(device)
+    saliency_mask = saliency.attribute(input_mask, target=target,
+                                       additional_forward_args=(model, x, edge_index, pairs), abs=False)
+
+    return split_to_edges(saliency_mask.cpu().numpy(), pairs)
+
+
 def explain_ig_node(model, x, edge_index, target, include_edges=None):
     ig = IntegratedGradients(model_forward_node)
     input_mask = x.clone().requires_grad_(True).to(device)
@@ -158,16 +175,31 @@ def explain_ig_node(model, x, edge_index, target, include_edges=None):
     return edge_mask
 
 
-def explain_ig(model, x, edge_index, target, include_edges=None):
+def explain_ig(model, x, edge_index, target, include_edges=None, n_steps=50, deadline=None):
+    n_steps = min(int(n_steps), MAX_STEPS)
+    # every step is one forward and backward, as long as computing the edge gradients once
+    n_steps = scale_iterations(deadline, n_steps, lambda: explain_sa(model, x, edge_index, target))
     ig = IntegratedGradients(model_forward)
     input_mask = torch.ones(edge_index.shape[1]).requires_grad_(True).to(device)
     ig_mask = ig.attribute(input_mask, target=target, additional_forward_args=(model, x, edge_index),
-                           internal_batch_size=edge_index.shape[1])
+                           internal_batch_size=edge_index.shape[1], n_steps=n_steps)
 
     edge_mask = ig_mask.cpu().detach().numpy()
     return edge_mask
 
 
+def explain_ig_symmetric(model, x, edge_index, target, include_edges=None, n_steps=50, deadline=None):
+    n_steps = min(int(n_steps), MAX_STEPS)
+    n_steps = scale_iterations(deadline, n_steps, lambda: explain_sa_symmetric(model, x, edge_index, target))
+    pairs, num_pairs = edge_pairs(edge_index, x.shape[0])
+    ig = IntegratedGradients(model_forward_symmetric)
+    input_mask = torch.ones(num_pairs).requires_grad_(True).to(device)
+    ig_mask = ig.attribute(input_mask, target=target, additional_forward_args=(model, x, edge_index, pairs),
+                           internal_batch_size=num_pairs, n_steps=n_steps)
+
+    return split_to_edges(ig_mask.cpu().detach().numpy(), pairs)
+
+
 def explain_occlusion(model, x, edge_index, target, include_edges=None):
     batch = torch.zeros(x.shape[0], dtype=int)
     pred_prob = model(x, edge_index, batch)[0][target].item()
@@ -185,15 +217,121 @@ def explain_occlusion(model, x, edge_index, target, include_edges=None):
     return edge_mask
 
 
-def explain_gnnexplainer(model, x, edge_index, target, include_edges=None, epochs=200, **kwargs):
-    epochs = min(epochs, 600)
+def explain_occlusion_hierarchical(model, x, edge_index, target, include_edges=None, top_k=10, threshold=0.0,
+                                   rings=True, undirected=False):
+    """
+    :param undirected: the groups are split on undirected edges, so that both directions of an edge are always removed
+    together and `top_k` counts undirected edges
+    """
+    num_edges = edge_index.shape[1]
+    candidates = np.arange(num_edges)
+    if include_edges is not None:
+        candidates = candidates[include_edges.cpu().numpy()]
+    candidates = sort_edges(edge_index, candidates)
+    groups = ring_groups(edge_index, candidates) if rings else [candidates]
+
+    if undirected:
+        # both directions of an edge are in the same ring group, each group becomes the group of its undirected edges
+        pairs, num_pairs = edge_pairs(edge_index, x.shape[0])
+        pairs_numpy = pairs.cpu().numpy()
+
+        def evaluate_pairs(removed_groups):
+            masks = removal_masks(num_edges, [np.flatnonzero(np.isin(pairs_numpy, group)) for group in removed_groups])
+            return masked_forward(model, x, edge_index, masks)[:, target].numpy()
+
+        pair_groups = [np.unique(pairs_numpy[group]) for group in groups]
+        pair_mask = hierarchical_occlusion(evaluate_pairs, num_pairs, pair_groups, int(top_k), float(threshold))
+        return split_to_edges(pair_mask, pairs)
+
+    def evaluate(removed_groups):
+        masks = removal_masks(num_edges, removed_groups)
+        return masked_forward(model, x, edge_index, masks)[:, target].numpy()
+
+    return hierarchical_occlusion(evaluate, num_edges, groups, int(top_k), float(threshold))
+
+
+def explain_shapley(model, x, edge_index, target, include_edges=None, num_samples=64, tolerance=1e-3, deadline=None):
+    num_samples = min(int(num_samples), MAX_SHAPLEY_SAMPLES)
+    # players are the edges of the graph, the value of a coalition is the target probability
+    num_edges = edge_index.shape[1]
+    players = np.arange(num_edges)
+    if include_edges is not None:
+        players = players[include_edges.cpu().numpy()]
+
+    def evaluate(coalitions):
+        masks = np.ones((coalitions.shape[0], num_edges), dtype=bool)
+        masks[:, players] = coalitions
+        return masked_forward(model, x, edge_index, masks)[:, target].exp().numpy()
+
+    values, _ = shapley_values(evaluate, len(players), int(num_samples), float(tolerance), deadline=deadline)
+    edge_mask = np.zeros(num_edges)
+    edge_mask[players] = values
+    return edge_mask
+
+
+def counterfactual(model, x, edge_index, target, include_edges=None, beam_width=5, max_deletions=10,
+                   max_candidates=50, time_budget=2.0, undirected=False):
+    """
+    :param undirected: both directions of each edge are deleted together
+    :return: see `explainers.counterfactual.counterfactual_search`
+    """
+    num_edges = edge_index.shape[1]
+    candidates = np.arange(num_edges)
+    if include_edges is not None:
+        candidates = candidates[include_edges.cpu().numpy()]
+    if undirected:
+        groups = undirected_groups(edge_index, candidates)
+    else:
+        groups = [candidates[[idx]] for idx in range(len(candidates))]
+    gradients = explain_sa(model, x, edge_index, target)
+    scores = [gradients[group].sum() for group in groups]
+
+    def evaluate(removed_groups):
+        return masked_forward(model, x, edge_index, removal_masks(num_edges, removed_groups)).numpy()
+
+    result = counterfactual_search(evaluate, groups, scores, target, int(beam_width), int(max_deletions),
+                                   int(max_candidates), float(time_budget))
+    # the forward of the gradients ranking the candidates
+    result['num_forwards'] += 1
+    return result
+
+
+def explain_counterfactual(model, x, edge_index, target, include_edges=None, undirected=False, **kwargs):
+    # the deleted edges of the counterfactual get attribution one, all edges get zero if no deletion within the limits
+    # changes the prediction
+    result = counterfactual(model, x, edge_index, target, include_edges, undirected=undirected, **kwargs)
+    edge_mask = np.zeros(edge_index.shape[1])
+    if result['flipped']:
+        edge_mask[result['edges']] = 1
+    return edge_mask
+
+
+def explain_gnnexplainer(model, x, edge_index, target, include_edges=None, epochs=200, deadline=None, **kwargs):
+    epochs = min(int(epochs), MAX_EPOCHS)
     explainer = TargetedGNNExplainerGraph(model, epochs=epochs, log=False)
     explainer.coeffs.update(kwargs)
     batch = torch.zeros(x.shape[0], dtype=int)
-    node_feat_mask, edge_mask = explainer.explain_with_target(x, edge_index, target_class=target, batch=batch)
+    node_feat_mask, edge_mask = explainer.explain_with_target(x, edge_index, target_class=target, deadline=deadline,
+                                                              batch=batch)
     return edge_mask.cpu().numpy()
 
 
+def explain_gnnexplainer_symmetric(model, x, edge_index, target, include_edges=None, epochs=200, deadline=None,
+                                   **kwargs):
+    epochs = min(int(epochs), MAX_EPOCHS)
+    pairs, num_pairs = edge_pairs(edge_index, x.shape[0])
+    explainer = SymmetricGNNExplainer(model, epochs=epochs)
+    explainer.coeffs.update(kwargs)
+    batch = torch.zeros(x.shape[0], dtype=int)
+
+    def forward(h, edge_weight):
+        return model(h, edge_index, batch, edge_weight)[0]
+
+    node_feat_mask, pair_mask = explainer.explain_with_target(forward, x, pairs, num_pairs, target, deadline)
+    # like the directed version, each direction gets the value of the mask applied to it
+    return pair_mask[pairs].cpu().numpy()
+
+
 methods = {
     'sa': explain_sa,
     'ig': explain_ig,
@@ -202,4 +340,14 @@ methods = {
     'random': explain_random,
     'pagerank': explain_pagerank,
     'gnnexplainer': explain_gnnexplainer,
+    'occlusion_hierarchical': explain_occlusion_hierarchical,
+    'shapley': explain_shapley,
+    'counterfactual': explain_counterfactual,
+}
+
+# variants used for undirected graphs, with a single parameter for both directions of each edge
+symmetric_methods = {
+    'sa': explain_sa_symmetric,
+    'ig': explain_ig_symmetric,
+    'gnnexplainer': explain_gnnexplainer_symmetric,
 }
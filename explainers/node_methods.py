@@ -1,3 +1,4 @@
+import time
 from typing import Union, Tuple, Any
 
 import networkx as nx
@@ -19,12 +20,24 @@ from captum.attr import Saliency, IntegratedGradients, LayerGradCam
 from torch import Tensor
 from torch_geometric.data import Data
 from torch_geometric.nn import MessagePassing
-from torch_geometric.utils import to_networkx
+from torch_geometric.utils import to_networkx, k_hop_subgraph
 
 from explainers.pgm_explainer import Node_Explainer
-from explainers.gnn_explainer import TargetedGNNExplainer
+from explainers.gnn_explainer import TargetedGNNExplainer, SymmetricGNNExplainer
+from explainers.sparse_graph import distance_attributions, pagerank_attributions
+from explainers.batched import masked_forward, removal_masks
+from explainers.group_occlusion import hierarchical_occlusion, sort_edges
+from explainers.shapley import shapley_values
+from explainers.counterfactual import counterfactual_search, undirected_groups
+from explainers.symmetric import edge_pairs, pair_candidates, split_to_edges
+from explainers.deadline import deadline_expired, scale_iterations
 
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+# limits of the iterations of the methods, a deadline can only lower the work further
+MAX_EPOCHS = 600
+MAX_SAMPLES = 300
+MAX_SHAPLEY_SAMPLES = 1024
+MAX_STEPS = 200
 
 
 class GraphLayerGradCam(LayerGradCam):
@@ -73,6 +86,10 @@ def model_forward(edge_mask, model, node_idx, x, edge_index):
     return out[[node_idx]]
 
 
+def model_forward_symmetric(pair_mask, model, node_idx, x, edge_index, pairs):
+    return model_forward(pair_mask[pairs], model, node_idx, x, edge_index)
+
+
 def model_forward_node(x, model, edge_index, node_idx):
     out = model(x, edge_index)
     return out[[node_idx]]
@@ -114,29 +131,25 @@ def explain_gradXact(model, node_idx, x, edge_index, target, include_edges=None)
 
 
 def explain_distance(model, node_idx, x, edge_index, target, include_edges=None):
-    data = Data(x=x, edge_index=edge_index)
-    g = to_networkx(data)
-    length = nx.shortest_path_length(g, target=node_idx)
+    return distance_attributions(edge_index, x.shape[0], [node_idx])[0]
 
-    def get_attr(node):
-        if node in length:
-            return 1 / (length[node] + 1)
-        return 0
 
-    edge_sources = edge_index[1].cpu().numpy()
-    return np.array([get_attr(node) for node in edge_sources])
+def explain_pagerank(model, node_idx, x, edge_index, target, include_edges=None):
+    return pagerank_attributions(edge_index, x.shape[0], [node_idx])[0]
 
 
-def explain_pagerank(model, node_idx, x, edge_index, target, include_edges=None):
-    data = Data(x=x, edge_index=edge_index)
-    g = to_networkx(data)
-    pagerank = nx.pagerank(g, personalization={node_idx: 1})
+def explain_distance_nodes(model, node_indices, x, edge_index, target=None):
+    """
+    Explains many nodes at once, returns an array with one row of edge attributions for each node
+    """
+    return distance_attributions(edge_index, x.shape[0], node_indices)
 
-    node_attr = np.zeros(x.shape[0])
-    for node, value in pagerank.items():
-        node_attr[node] = value
-    edge_mask = node_attr_to_edge(edge_index, node_attr)
-    return edge_mask
+
+def explain_pagerank_nodes(model, node_indices, x, edge_index, target=None):
+    """
+    Explains many nodes at once, returns an array with one row of edge attributions for each node
+    """
+    return pagerank_attributions(edge_index, x.shape[0], node_indices)
 
 
 def explain_sa_node(model, node_idx, x, edge_index, target, include_edges=None):
@@ -160,6 +173,16 @@ def explain_sa(model, node_idx, x, edge_index, target, include_edges=None):
     return edge_mask
 
 
+def explain_sa_symmetric(model, node_idx, x, edge_index, target, include_edges=None):
+    pairs, num_pairs = edge_pairs(edge_index, x.shape[0])
+    saliency = Saliency(model_forward_symmetric)
+    input_mask = torch.ones(num_pairs).requires_grad_(True).to(device)
+    saliency_mask = saliency.attribute(input_mask, target=target,
+                                       additional_forward_args=(model, node_idx, x, edge_index, pairs), abs=False)
+
+    return split_to_edges(saliency_mask.cpu().numpy(), pairs)
+
+
 def explain_ig_node(model, node_idx, x, edge_index, target, include_edges=None):
     ig = IntegratedGradients(model_forward_node)
     input_mask = x.clone().requires_grad_(True).to(device)
@@ -171,32 +194,54 @@ def explain_ig_node(model, node_idx, x, edge_index, target, include_edges=None):
     return edge_mask
 
 
-def explain_ig(model, node_idx, x, edge_index, target, include_edges=None):
+def explain_ig(model, node_idx, x, edge_index, target, include_edges=None, n_steps=50, deadline=None):
+    n_steps = min(int(n_steps), MAX_STEPS)
+    # every step is one forward and backward, as long as computing the edge gradients once
+    n_steps = scale_iterations(deadline, n_steps, lambda: explain_sa(model, node_idx, x, edge_index, target))
     ig = IntegratedGradients(model_forward)
     input_mask = torch.ones(edge_index.shape[1]).requires_grad_(True).to(device)
     ig_mask = ig.attribute(input_mask, target=target, additional_forward_args=(model, node_idx, x, edge_index),
-                           internal_batch_size=edge_index.shape[1])
+                           internal_batch_size=edge_index.shape[1], n_steps=n_steps)
 
     edge_mask = ig_mask.cpu().detach().numpy()
     return edge_mask
 
 
-def explain_occlusion(model, node_idx, x, edge_index, target, include_edges=None):
+def explain_ig_symmetric(model, node_idx, x, edge_index, target, include_edges=None, n_steps=50, deadline=None):
+    n_steps = min(int(n_steps), MAX_STEPS)
+    n_steps = scale_iterations(deadline, n_steps,
+                               lambda: explain_sa_symmetric(model, node_idx, x, edge_index, target))
+    pairs, num_pairs = edge_pairs(edge_index, x.shape[0])
+    ig = IntegratedGradients(model_forward_symmetric)
+    input_mask = torch.ones(num_pairs).requires_grad_(True).to(device)
+    ig_mask = ig.attribute(input_mask, target=target, additional_forward_args=(model, node_idx, x, edge_index, pairs),
+                           internal_batch_size=num_pairs, n_steps=n_steps)
+
+    return split_to_edges(ig_mask.cpu().detach().numpy(), pairs)
+
+
+def explain_occlusion(model, node_idx, x, edge_index, target, include_edges=None, deadline=None):
     depth_limit = len(model.convs) + 1
     data = Data(x=x, edge_index=edge_index)
     pred_prob = model(data.x, data.edge_index)[node_idx][target].item()
     g = to_networkx(data)
     subgraph_nodes = []
+    node_distance = np.full(data.num_nodes, depth_limit)
     for k, v in nx.shortest_path_length(g, target=node_idx).items():
         if v < depth_limit:
             subgraph_nodes.append(k)
+            node_distance[k] = v
     subgraph = g.subgraph(subgraph_nodes)
     edge_occlusion_mask = np.ones(data.num_edges, dtype=bool)
     edge_mask = np.zeros(data.num_edges)
     edge_index_numpy = data.edge_index.cpu().numpy()
-    for i in range(data.num_edges):
+    # the edges closest to the node are occluded first, so that they are done if the deadline expires
+    order = np.argsort(node_distance[edge_index_numpy[1]], kind='stable')
+    for i in order:
         if include_edges is not None and not include_edges[i].item():
             continue
+        if deadline_expired(deadline):
+            break
         u, v = list(edge_index_numpy[:, i])
         if (u, v) in subgraph.edges():
             edge_occlusion_mask[i] = False
@@ -238,20 +283,180 @@ def explain_occlusion_undirected(model, node_idx, x, edge_index, target, include
     return edge_mask
 
 
-def explain_gnnexplainer(model, node_idx, x, edge_index, target, include_edges=None, epochs=200, **kwargs):
-    epochs = min(epochs, 600)
+def explain_occlusion_symmetric(model, node_idx, x, edge_index, target, include_edges=None, chunk_size=256,
+                                deadline=None):
+    # both directions of each edge in the receptive field are removed together, in batched evaluations
+    subset, sub_edge_index, mapping, hard_edge_mask = k_hop_subgraph(node_idx, len(model.convs), edge_index,
+                                                                    relabel_nodes=True, num_nodes=x.shape[0])
+    hard_edge_mask = hard_edge_mask.cpu().numpy()
+    candidates = np.flatnonzero(hard_edge_mask)
+    if include_edges is not None:
+        candidates = candidates[include_edges.cpu().numpy()[candidates]]
+    pairs, num_pairs = edge_pairs(edge_index, x.shape[0])
+    removed_pairs = pair_candidates(pairs, candidates)
+    sub_pairs = pairs.cpu().numpy()[hard_edge_mask]
+    # the edges closest to the node are occluded first, so that they are done if the deadline expires
+    closeness = np.zeros(num_pairs)
+    np.maximum.at(closeness, sub_pairs, distance_attributions(sub_edge_index, len(subset), [int(mapping[0])])[0])
+    removed_pairs = removed_pairs[np.argsort(-closeness[removed_pairs], kind='stable')]
+    # the first row removes nothing, the masks are built for a chunk of rows at a time since all of them would need
+    # (edges x edges) memory
+    rows = np.concatenate([[-1], removed_pairs])
+    scores = []
+    # with a deadline the first chunk measures the time of one row, the next ones grow while they fit in the
+    # remaining time with some margin since larger chunks take a bit longer per row
+    start, size, row_time = 0, chunk_size if deadline is None else min(chunk_size, 8), None
+    while start < len(rows):
+        if deadline is not None and start > 0:
+            if deadline_expired(deadline):
+                break
+            size = min(chunk_size, 2 * size, max(1, int(0.8 * deadline.remaining() / row_time)))
+        chunk_start = time.perf_counter()
+        masks = sub_pairs[None, :] != rows[start:start + size, None]
+        scores.append(masked_forward(model, x[subset], sub_edge_index, masks, int(mapping[0]))[:, target].numpy())
+        row_time = (time.perf_counter() - chunk_start) / len(masks)
+        start += size
+    scores = np.concatenate(scores)
+    pair_mask = np.zeros(num_pairs)
+    pair_mask[removed_pairs[:len(scores) - 1]] = scores[0] - scores[1:]
+    return split_to_edges(pair_mask, pairs)
+
+
+def explain_occlusion_hierarchical(model, node_idx, x, edge_index, target, include_edges=None, top_k=10,
+                                   threshold=0.0, undirected=False):
+    """
+    :param undirected: the groups are split on undirected edges, so that both directions of an edge are always removed
+    together and `top_k` counts undirected edges
+    """
+    num_edges = edge_index.shape[1]
+    subset, sub_edge_index, mapping, hard_edge_mask = k_hop_subgraph(node_idx, len(model.convs), edge_index,
+                                                                    relabel_nodes=True, num_nodes=x.shape[0])
+    candidates = np.flatnonzero(hard_edge_mask.cpu().numpy())
+    # position of each candidate edge in the receptive field subgraph
+    sub_positions = np.full(num_edges, -1)
+    sub_positions[candidates] = np.arange(len(candidates))
+    if include_edges is not None:
+        candidates = candidates[include_edges.cpu().numpy()[candidates]]
+
+    if undirected:
+        pairs, num_pairs = edge_pairs(edge_index, x.shape[0])
+        sub_pairs = pairs.cpu().numpy()[hard_edge_mask.cpu().numpy()]
+
+        def evaluate_pairs(removed_groups):
+            removed = [np.flatnonzero(np.isin(sub_pairs, group)) for group in removed_groups]
+            masks = removal_masks(sub_edge_index.shape[1], removed)
+            return masked_forward(model, x[subset], sub_edge_index, masks, int(mapping[0]))[:, target].numpy()
+
+        pair_mask = hierarchical_occlusion(evaluate_pairs, num_pairs, [pair_candidates(pairs, candidates)],
+                                           int(top_k), float(threshold))
+        return split_to_edges(pair_mask, pairs)
+
+    def evaluate(removed_groups):
+        masks = removal_masks(sub_edge_index.shape[1], [sub_positions[group] for group in removed_groups])
+        return masked_forward(model, x[subset], sub_edge_index, masks, int(mapping[0]))[:, target].numpy()
+
+    groups = [sort_edges(edge_index, candidates)]
+    return hierarchical_occlusion(evaluate, num_edges, groups, int(top_k), float(threshold))
+
+
+def explain_shapley(model, node_idx, x, edge_index, target, include_edges=None, num_samples=64, tolerance=1e-3,
+                    deadline=None):
+    num_samples = min(int(num_samples), MAX_SHAPLEY_SAMPLES)
+    # players are the edges in the receptive field of the node, the value of a coalition is the target probability
+    subset, sub_edge_index, mapping, hard_edge_mask = k_hop_subgraph(node_idx, len(model.convs), edge_index,
+                                                                    relabel_nodes=True, num_nodes=x.shape[0])
+    candidates = np.flatnonzero(hard_edge_mask.cpu().numpy())
+    players = np.arange(len(candidates))
+    if include_edges is not None:
+        players = players[include_edges.cpu().numpy()[candidates]]
+
+    def evaluate(coalitions):
+        masks = np.ones((coalitions.shape[0], sub_edge_index.shape[1]), dtype=bool)
+        masks[:, players] = coalitions
+        return masked_forward(model, x[subset], sub_edge_index, masks, int(mapping[0]))[:, target].exp().numpy()
+
+    values, _ = shapley_values(evaluate, len(players), int(num_samples), float(tolerance), deadline=deadline)
+    edge_mask = np.zeros(edge_index.shape[1])
+    edge_mask[candidates[players]] = values
+    return edge_mask
+
+
+def counterfactual(model, node_idx, x, edge_index, target, include_edges=None, beam_width=5, max_deletions=10,
+                   max_candidates=50, time_budget=2.0, undirected=False):
+    """
+    :param undirected: both directions of each edge are deleted together
+    :return: see `explainers.counterfactual.counterfactual_search`
+    """
+    subset, sub_edge_index, mapping, hard_edge_mask = k_hop_subgraph(node_idx, len(model.convs), edge_index,
+                                                                    relabel_nodes=True, num_nodes=x.shape[0])
+    candidates = np.flatnonzero(hard_edge_mask.cpu().numpy())
+    sub_positions = np.full(edge_index.shape[1], -1)
+    sub_positions[candidates] = np.arange(len(candidates))
+    if include_edges is not None:
+        candidates = candidates[include_edges.cpu().numpy()[candidates]]
+    if undirected:
+        groups = undirected_groups(edge_index, candidates)
+    else:
+        groups = [candidates[[idx]] for idx in range(len(candidates))]
+    gradients = explain_sa(model, node_idx, x, edge_index, target)
+    scores = [gradients[group].sum() for group in groups]
+
+    def evaluate(removed_groups):
+        masks = removal_masks(sub_edge_index.shape[1], [sub_positions[group] for group in removed_groups])
+        return masked_forward(model, x[subset], sub_edge_index, masks, int(mapping[0])).numpy()
+
+    result = counterfactual_search(evaluate, groups, scores, target, int(beam_width), int(max_deletions),
+                                   int(max_candidates), float(time_budget))
+    # the forward of the gradients ranking the candidates
+    result['num_forwards'] += 1
+    return result
+
+
+def explain_counterfactual(model, node_idx, x, edge_index, target, include_edges=None, undirected=False, **kwargs):
+    # the deleted edges of the counterfactual get attribution one, all edges get zero if no deletion within the limits
+    # changes the prediction
+    result = counterfactual(model, node_idx, x, edge_index, target, include_edges, undirected=undirected, **kwargs)
+    edge_mask = np.zeros(edge_index.shape[1])
+    if result['flipped']:
+        edge_mask[result['edges']] = 1
+    return edge_mask
+
+
+def explain_gnnexplainer(model, node_idx, x, edge_index, target, include_edges=None, epochs=200, deadline=None,
+                         **kwargs):
+    epochs = min(int(epochs), MAX_EPOCHS)
     explainer = TargetedGNNExplainer(model, epochs=epochs, log=False)
     explainer.coeffs.update(kwargs)
-    node_feat_mask, edge_mask = explainer.explain_node_with_target(node_idx, x, edge_index, target_class=target)
+    node_feat_mask, edge_mask = explainer.explain_node_with_target(node_idx, x, edge_index, target_class=target,
+                                                                   deadline=deadline)
     return edge_mask.cpu().numpy()
 
 
+def explain_gnnexplainer_symmetric(model, node_idx, x, edge_index, target, include_edges=None, epochs=200,
+                                   deadline=None, **kwargs):
+    epochs = min(int(epochs), MAX_EPOCHS)
+    subset, sub_edge_index, mapping, hard_edge_mask = k_hop_subgraph(node_idx, len(model.convs), edge_index,
+                                                                    relabel_nodes=True, num_nodes=x.shape[0])
+    pairs, num_pairs = edge_pairs(sub_edge_index, len(subset))
+    explainer = SymmetricGNNExplainer(model, epochs=epochs)
+    explainer.coeffs.update(kwargs)
+
+    def forward(h, edge_weight):
+        return model(h, sub_edge_index, edge_weight)[int(mapping[0])]
+
+    node_feat_mask, pair_mask = explainer.explain_with_target(forward, x[subset], pairs, num_pairs, target, deadline)
+    # like the directed version, each direction gets the value of the mask applied to it
+    edge_mask = np.zeros(edge_index.shape[1])
+    edge_mask[hard_edge_mask.cpu().numpy()] = pair_mask[pairs].cpu().numpy()
+    return edge_mask
+
+
 def explain_pgmexplainer(model, node_idx, x, edge_index, target, include_edges=None, num_samples=100, p_threshold=0.05,
-                         pred_threshold=0.1):
-    num_samples = min(num_samples, 300)
+                         pred_threshold=0.1, deadline=None):
+    num_samples = min(int(num_samples), MAX_SAMPLES)
     explainer = Node_Explainer(model, edge_index, x, len(model.convs), print_result=0)
     explanation = explainer.explain(node_idx, target, num_samples=num_samples, p_threshold=p_threshold,
-                                    pred_threshold=pred_threshold)
+                                    pred_threshold=pred_threshold, deadline=deadline)
     node_attr = np.zeros(x.shape[0])
     for node, p_value in explanation.items():
         node_attr[node] = 1 - p_value
@@ -270,5 +475,16 @@ methods = {
     'distance': explain_distance,
     'gradXact': explain_gradXact,
     'pgmexplainer': explain_pgmexplainer,
-    'occlusion': explain_occlusion
+    'occlusion': explain_occlusion,
+    'occlusion_hierarchical': explain_occlusion_hierarchical,
+    'shapley': explain_shapley,
+    'counterfactual': explain_counterfactual,
+}
+
+# variants used for undirected graphs, with a single parameter for both directions of each edge
+symmetric_methods = {
+    'sa': explain_sa_symmetric,
+    'ig': explain_ig_symmetric,
+    'gnnexplainer': explain_gnnexplainer_symmetric,
+    'occlusion': explain_occlusion_symmetric,
 }
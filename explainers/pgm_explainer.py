@@ -5,7 +5,11 @@ from pgmpy.estimators.CITests import chi_square
 from scipy.special import softmax
 from torch_geometric.utils import k_hop_subgraph
 
+from explainers.deadline import deadline_expired
+
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+# samples drawn even when the deadline expired, the statistical tests need a few samples
+MIN_SAMPLES = 10
 
 class Node_Explainer:
     def __init__(
@@ -46,7 +50,8 @@ class Node_Explainer:
             X_perturb[node_idx] = perturb_array
         return X_perturb
 
-    def explain(self, node_idx, target, num_samples=100, top_node=None, p_threshold=0.05, pred_threshold=0.1):
+    def explain(self, node_idx, target, num_samples=100, top_node=None, p_threshold=0.05, pred_threshold=0.1,
+                deadline=None):
         neighbors, _, _, _ = k_hop_subgraph(node_idx, self.num_layers, self.edge_index)
         neighbors = neighbors.cpu().detach().numpy()
 
@@ -64,6 +69,9 @@ class Node_Explainer:
         Pred_Samples = []
 
         for iteration in range(num_samples):
+            # a fifth of the time is kept for the statistical tests
+            if iteration >= MIN_SAMPLES and deadline_expired(deadline, reserve=0.2):
+                break
 
             X_perturb = self.X.cpu().detach().numpy()
             sample = []
@@ -0,0 +1,46 @@
+import numpy as np
+
+from explainers.deadline import deadline_expired
+
+
+def shapley_values(evaluate, num_players, num_samples=64, tolerance=1e-3, seed=None, deadline=None):
+    """
+    Monte-Carlo estimation of Shapley values with permutation sampling and antithetic pairs: each round samples a
+    permutation of the players and its reverse, and evaluates all the coalitions formed by their prefixes in a single
+    call of `evaluate`. Stops when the standard error of every estimate is below `tolerance` or after `num_samples`
+    permutations, or when the optional `deadline` expires.
+    :param evaluate: function that takes a boolean array of shape (number of coalitions, num_players) with True for
+    the present players and returns the value of each coalition
+    :return: (Shapley values, number of sampled permutations)
+    """
+    if num_players == 0:
+        return np.zeros(0), 0
+    rng = np.random.default_rng(seed)
+    prefix_sizes = np.arange(num_players + 1)[:, None]
+    sums = np.zeros(num_players)
+    squared_sums = np.zeros(num_players)
+    num_rounds = 0
+    for _ in range(max(1, num_samples // 2)):
+        if num_rounds >= 1 and deadline_expired(deadline):
+            break
+        permutation = rng.permutation(num_players)
+        ranks = []
+        for order in [permutation, permutation[::-1]]:
+            rank = np.empty(num_players, dtype=int)
+            rank[order] = np.arange(num_players)
+            ranks.append(rank)
+        # coalition j of a permutation contains the players with rank < j
+        coalitions = np.concatenate([prefix_sizes > rank[None, :] for rank in ranks])
+        values = np.asarray(evaluate(coalitions)).reshape(2, num_players + 1)
+        # the marginal contribution of a player is the value change when it joins the prefix before it
+        marginals = [np.diff(values[idx])[rank] for idx, rank in enumerate(ranks)]
+        sample = (marginals[0] + marginals[1]) / 2
+        sums += sample
+        squared_sums += sample ** 2
+        num_rounds += 1
+        if num_rounds >= 2:
+            mean = sums / num_rounds
+            variance = np.maximum(squared_sums - num_rounds * mean ** 2, 0) / (num_rounds - 1)
+            if np.sqrt(variance / num_rounds).max() < tolerance:
+                break
+    return sums / num_rounds, 2 * num_rounds
@@ -0,0 +1,100 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import shortest_path
+
+
+def to_numpy(edge_index):
+    if hasattr(edge_index, 'cpu'):
+        edge_index = edge_index.cpu().numpy()
+    return np.asarray(edge_index)
+
+
+def to_csr(edge_index, num_nodes):
+    """
+    Builds the adjacency matrix of the graph, parallel edges are counted once like in a networkx DiGraph
+    """
+    edge_index = to_numpy(edge_index)
+    values = np.ones(edge_index.shape[1])
+    adj = sp.csr_matrix((values, (edge_index[0], edge_index[1])), shape=(num_nodes, num_nodes))
+    adj.data[:] = 1
+    return adj
+
+
+def pagerank(adj, seeds=None, alpha=0.85, max_iter=100, tol=1.0e-6):
+    """
+    Power iteration pagerank with the same semantics as `networkx.pagerank`
+    :param seeds: node indices used for personalization, one pagerank vector is computed for each seed.
+    If None, a single non-personalized pagerank vector is computed.
+    :return: array with shape (number of seeds, number of nodes)
+    """
+    num_nodes = adj.shape[0]
+    if seeds is None:
+        personalization = np.full((1, num_nodes), 1.0 / num_nodes)
+    else:
+        seeds = np.asarray(seeds)
+        personalization = np.zeros((len(seeds), num_nodes))
+        personalization[np.arange(len(seeds)), seeds] = 1
+    if num_nodes == 0:
+        return personalization
+
+    out_degree = np.asarray(adj.sum(axis=1)).ravel()
+    dangling = out_degree == 0
+    inv_degree = np.divide(1.0, out_degree, out=np.zeros(num_nodes), where=~dangling)
+    # transposed transition matrix, each column of the result is one pagerank vector
+    transition_t = (sp.diags(inv_degree) @ adj).T.tocsr()
+
+    p = personalization.T
+    x = np.full_like(p, 1.0 / num_nodes)
+    active = np.ones(p.shape[1], dtype=bool)
+    for _ in range(max_iter):
+        x_active = x[:, active]
+        p_active = p[:, active]
+        new_x = alpha * (transition_t @ x_active + x_active[dangling].sum(axis=0) * p_active) + (1 - alpha) * p_active
+        err = np.abs(new_x - x_active).sum(axis=0)
+        x[:, active] = new_x
+        # stop updating the vectors which have converged, like networkx does for a single vector
+        converged = err < num_nodes * tol
+        active_indices = np.flatnonzero(active)
+        active[active_indices[converged]] = False
+        if not active.any():
+            break
+    return x.T
+
+
+def distances_to(adj, targets):
+    """
+    Breadth first search distances from all nodes to each target node, following edge directions
+    :return: array with shape (number of targets, number of nodes), unreachable nodes have distance `inf`
+    """
+    return shortest_path(adj.T, method='D', unweighted=True, indices=np.asarray(targets))
+
+
+def node_attr_to_edge_batch(edge_index, node_attrs):
+    """
+    Batched version of `node_attr_to_edge`, `node_attrs` has shape (number of explanations, number of nodes)
+    """
+    edge_index = to_numpy(edge_index)
+    return node_attrs[:, edge_index[0]] + node_attrs[:, edge_index[1]]
+
+
+def pagerank_attributions(edge_index, num_nodes, node_indices=None):
+    """
+    :return: pagerank edge attributions with shape (number of explained nodes, number of edges). If `node_indices` is
+    None a single non-personalized explanation is returned.
+    """
+    adj = to_csr(edge_index, num_nodes)
+    return node_attr_to_edge_batch(edge_index, pagerank(adj, node_indices))
+
+
+def distance_attributions(edge_index, num_nodes, node_indices):
+    """
+    :return: edge attributions with shape (number of explained nodes, number of edges). The attribution of an edge is
+    1 / (d + 1) where d is the distance from its target to the explained node, or zero if it is unreachable.
+    """
+    adj = to_csr(edge_index, num_nodes)
+    distances = distances_to(adj, node_indices)
+    node_attrs = np.zeros_like(distances)
+    reachable = np.isfinite(distances)
+    node_attrs[reachable] = 1 / (distances[reachable] + 1)
+    edge_index = to_numpy(edge_index)
+    return node_attrs[:, edge_index[1]]
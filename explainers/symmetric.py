@@ -0,0 +1,32 @@
+import numpy as np
+import torch
+
+
+def edge_pairs(edge_index, num_nodes):
+    """
+    Maps the two directions of every undirected edge to the same parameter
+    :return: (parameter id of each directed edge as a LongTensor, number of parameters)
+    """
+    edge_index_numpy = edge_index.cpu().numpy()
+    keys = np.minimum(*edge_index_numpy) * num_nodes + np.maximum(*edge_index_numpy)
+    _, pairs = np.unique(keys, return_inverse=True)
+    num_pairs = int(pairs.max()) + 1 if len(pairs) else 0
+    return torch.from_numpy(pairs.reshape(-1)).to(edge_index.device), num_pairs
+
+
+def pair_candidates(pairs, edges):
+    """
+    :param edges: ids of the candidate directed edges
+    :return: ids of the parameters with at least one candidate direction
+    """
+    return np.unique(pairs.cpu().numpy()[edges])
+
+
+def split_to_edges(pair_values, pairs):
+    """
+    Spreads the attribution of each parameter evenly over its directions, so that summing both directions of an edge
+    gives back the attribution of the undirected edge
+    """
+    pairs = pairs.cpu().numpy()
+    counts = np.bincount(pairs, minlength=len(pair_values))
+    return np.asarray(pair_values)[pairs] / counts[pairs]
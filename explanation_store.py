@@ -0,0 +1,155 @@
+# Precomputes the explanations of the sample graphs so that the web service can serve them without running the
+# explanation methods. Build the store with `python explanation_store.py` and restart the web service.
+#
+# The store of each experiment is a directory with:
+#   `attributions.npy`: float32 array with all attributions, opened with memory mapping
+#   `index.json`: maps graph fingerprints to samples and (sample, node, method, target) keys to attribution offsets
+
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+import torch
+
+STORE_PATH = 'explanation_store'
+
+# These are the default hyperparameters of the UI, requests with other hyperparameters are not served from the store
+DEFAULT_METHOD_CONFIGS = {
+    'gnnexplainer': {'epochs': 400, 'edge_size': 0.005, 'node_feat_size': 1.0, 'edge_ent': 1.0, 'node_feat_ent': 0.1},
+    'pgmexplainer': {'num_samples': 100, 'p_threshold': 0.05, 'pred_threshold': 0.1},
+}
+# methods whose result should differ between requests are never served from the store
+UNCACHED_METHODS = ['random']
+
+
+def canonical_graph(nodes, edges):
+    """
+    Computes a fingerprint of the graph which does not depend on the order of nodes and edges
+    :return: (fingerprint, order) where `order[i]` is the index in `edges` of the i-th edge in canonical order
+    """
+    node_keys = [str(node['id']) for node in nodes]
+    pairs = [(node_keys[u], node_keys[v]) for u, v in edges]
+    order = sorted(range(len(pairs)), key=pairs.__getitem__)
+    feats = sorted(zip(node_keys, [node['feat'] for node in nodes]))
+    content = json.dumps([feats, [pairs[i] for i in order]])
+    return hashlib.sha1(content.encode()).hexdigest(), order
+
+
+def method_key(method):
+    # the browser serializes integral floats without a decimal point, e.g. 1.0 is sent as 1
+    method = {k: int(v) if isinstance(v, float) and v.is_integer() else v for k, v in method.items()}
+    return json.dumps(method, sort_keys=True)
+
+
+def entry_key(sample_idx, node_key, method, target):
+    return f'{sample_idx}|{node_key}|{method_key(method)}|{target}'
+
+
+class ExplanationStore:
+    def __init__(self, path):
+        with open(os.path.join(path, 'index.json')) as f:
+            index = json.load(f)
+        self.samples = index['samples']
+        self.entries = index['entries']
+        self.attributions = np.load(os.path.join(path, 'attributions.npy'), mmap_mode='r')
+
+    @classmethod
+    def load(cls, experiment_name, root=STORE_PATH):
+        path = os.path.join(root, experiment_name)
+        if not os.path.exists(os.path.join(path, 'index.json')):
+            return None
+        return cls(path)
+
+    def lookup(self, nodes, edges, node_index, target, method):
+        """
+        :return: attributions in the order of `edges` if the graph is one of the samples and the explanation is
+        precomputed, otherwise None
+        """
+        if method['name'] in UNCACHED_METHODS:
+            return None
+        fingerprint, order = canonical_graph(nodes, edges)
+        sample = self.samples.get(fingerprint)
+        if sample is None:
+            return None
+        node_key = '' if node_index is None else str(nodes[node_index]['id'])
+        offset = self.entries.get(entry_key(sample['sample'], node_key, method, target))
+        if offset is None:
+            return None
+        attributions = np.empty(len(edges))
+        attributions[order] = self.attributions[offset:offset + len(edges)]
+        return attributions
+
+
+def num_classes(experiment, nodes, edges):
+    data = experiment.make_data(nodes, edges)
+    with torch.no_grad():
+        if experiment.is_graph_classification():
+            batch = torch.zeros(data.x.shape[0], dtype=int)
+            return experiment.model(data.x, data.edge_index, batch).shape[1]
+        return experiment.model(data.x, data.edge_index).shape[1]
+
+
+def build(experiment, path, methods, max_nodes=None):
+    # imported here since the web service itself loads the stores from this module
+    from web_service import make_node_mappings, make_edges
+
+    methods = [name for name in methods if name not in UNCACHED_METHODS]
+    samples = {}
+    entries = {}
+    chunks = []
+    offset = 0
+    for sample_idx, sample in enumerate(experiment.sample_graphs()):
+        nodes = sample['nodes']
+        edges = [{'source': u, 'target': v, 'id': idx} for idx, (u, v) in enumerate(sample['edges'])]
+        node_id_to_index, _ = make_node_mappings(nodes)
+        converted_edges, _ = make_edges(edges, node_id_to_index, experiment.is_directed())
+        fingerprint, order = canonical_graph(nodes, converted_edges)
+        samples[fingerprint] = {'sample': sample_idx, 'num_edges': len(converted_edges)}
+        if experiment.is_graph_classification():
+            node_indices = [None]
+        else:
+            node_indices = list(range(len(nodes)))[:max_nodes]
+        for node_index in node_indices:
+            node_key = '' if node_index is None else str(nodes[node_index]['id'])
+            for target in range(num_classes(experiment, nodes, converted_edges)):
+                for name in methods:
+                    method = dict(DEFAULT_METHOD_CONFIGS.get(name, {}), name=name)
+                    if node_index is None:
+                        attributions = experiment.explain_graph(nodes, converted_edges, target, dict(method))
+                    else:
+                        attributions = experiment.explain_node(nodes, converted_edges, node_index, target,
+                                                               dict(method))
+                    chunks.append(np.asarray(attributions, dtype=np.float32)[order])
+                    entries[entry_key(sample_idx, node_key, method, target)] = offset
+                    offset += len(converted_edges)
+        print(f'{experiment.name}: sample {sample_idx} done, {len(entries)} explanations so far', flush=True)
+
+    os.makedirs(path, exist_ok=True)
+    attributions = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.float32)
+    np.save(os.path.join(path, 'attributions.npy'), attributions)
+    with open(os.path.join(path, 'index.json'), 'w') as f:
+        json.dump({'samples': samples, 'entries': entries}, f)
+
+
+def main():
+    from web_service import experiments_registry
+
+    parser = argparse.ArgumentParser(description='Precomputes the explanations of all sample graphs')
+    parser.add_argument('--experiments', nargs='+', default=None, help='experiment names, defaults to all')
+    parser.add_argument('--methods', nargs='+', default=None, help='defaults to all methods of each experiment')
+    parser.add_argument('--max-nodes', type=int, default=None,
+                        help='only explain the first nodes of each sample in node classification experiments')
+    parser.add_argument('--output', default=STORE_PATH)
+    args = parser.parse_args()
+
+    for experiment in experiments_registry.values():
+        if args.experiments is not None and experiment.name not in args.experiments:
+            continue
+        methods = args.methods or experiment.get_explain_methods()
+        build(experiment, os.path.join(args.output, experiment.name), methods, args.max_nodes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+import math
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+from scipy.sparse.linalg import eigsh, ArpackNoConvergence
+
+from explanation_store import canonical_graph
+
+# number of graphs whose layout is kept in memory
+LAYOUT_CACHE_SIZE = int(os.environ.get('LAYOUT_CACHE_SIZE', '4096'))
+# distance in pixels between adjacent nodes
+EDGE_LENGTH = 60
+MAX_ITERATIONS = 100
+# bound on the pairs of nodes evaluated by the repulsive forces, large graphs get fewer force-directed iterations and
+# only the spectral layout above a few thousand nodes
+MAX_PAIR_EVALUATIONS = 5e7
+# pairs of nodes evaluated at once, bounds the memory of the repulsive forces
+CHUNK_PAIRS = 2 ** 21
+# the spectral layout uses a dense eigendecomposition below this number of nodes
+DENSE_EIGEN_NODES = 500
+
+
+def adjacency(num_nodes, edges):
+    """
+    :return: symmetric sparse adjacency matrix without self loops, the direction of the edges does not matter for
+    the layout
+    """
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    matrix = sp.coo_matrix((np.ones(len(edges)), (edges[:, 0], edges[:, 1])), shape=(num_nodes, num_nodes)).tocsr()
+    return ((matrix + matrix.T) > 0).astype(np.float64)
+
+
+def spectral_layout(matrix):
+    """
+    Positions the nodes of a connected graph with the eigenvectors of the second and third smallest eigenvalues of
+    the normalized Laplacian
+    """
+    num_nodes = matrix.shape[0]
+    if num_nodes <= 3:
+        return np.array([[0.0, 0.0], [1.0, 0.0], [0.5, 0.8]])[:num_nodes]
+    inv_sqrt_degree = 1 / np.sqrt(np.asarray(matrix.sum(axis=1)).ravel())
+    normalized = sp.diags(inv_sqrt_degree) @ matrix @ sp.diags(inv_sqrt_degree)
+    # the smallest eigenvalues of the Laplacian I - normalized are the largest of I + normalized, which converge
+    # faster with Lanczos
+    shifted = sp.eye(num_nodes) + normalized
+    if num_nodes < DENSE_EIGEN_NODES:
+        values, vectors = np.linalg.eigh(shifted.toarray())
+    else:
+        try:
+            values, vectors = eigsh(shifted, k=3, which='LA', tol=1e-3, maxiter=20 * num_nodes)
+        except ArpackNoConvergence as e:
+            values, vectors = e.eigenvalues, e.eigenvectors
+    order = np.argsort(-values)[1:3]
+    positions = vectors[:, order] * inv_sqrt_degree[:, None]
+    if positions.shape[1] < 2:
+        positions = np.concatenate([positions, np.zeros((num_nodes, 2 - positions.shape[1]))], axis=1)
+    return positions
+
+
+def force_directed_layout(matrix, positions, iterations):
+    """
+    Fruchterman-Reingold with an ideal edge length of 1. The attractive forces are computed on the edges only and
+    the repulsive forces on chunks of node pairs.
+    """
+    num_nodes = len(positions)
+    rows, cols = matrix.nonzero()
+    chunk_size = max(1, CHUNK_PAIRS // num_nodes)
+    temperature = 0.1 * math.sqrt(num_nodes)
+    cooling = (0.01 / 0.1) ** (1 / max(iterations, 1))
+    for _ in range(iterations):
+        displacement = np.zeros_like(positions)
+        for start in range(0, num_nodes, chunk_size):
+            delta = positions[start:start + chunk_size, None, :] - positions[None, :, :]
+            distance2 = np.maximum((delta ** 2).sum(axis=-1), 1e-4)
+            # repulsion 1 / distance along delta / distance, the node itself has a zero delta
+            displacement[start:start + chunk_size] += (delta / distance2[..., None]).sum(axis=1)
+        delta = positions[rows] - positions[cols]
+        # attraction distance^2 along delta / distance
+        attraction = delta * np.sqrt((delta ** 2).sum(axis=-1))[:, None]
+        displacement[:, 0] -= np.bincount(rows, attraction[:, 0], minlength=num_nodes)
+        displacement[:, 1] -= np.bincount(rows, attraction[:, 1], minlength=num_nodes)
+        length = np.maximum(np.sqrt((displacement ** 2).sum(axis=-1)), 1e-9)
+        positions = positions + displacement * (np.minimum(length, temperature) / length)[:, None]
+        temperature *= cooling
+    return positions
+
+
+def component_layout(matrix, seed=0):
+    num_nodes = matrix.shape[0]
+    positions = spectral_layout(matrix)
+    # spread the spectral layout over the area of a force-directed layout and separate nodes at the same position,
+    # e.g. the leaves of a star
+    positions = positions - positions.mean(axis=0)
+    positions = positions / max(positions.std(), 1e-9) * math.sqrt(num_nodes) / 2
+    positions += np.random.default_rng(seed).normal(scale=0.05, size=positions.shape)
+    iterations = int(min(MAX_ITERATIONS, MAX_PAIR_EVALUATIONS // num_nodes ** 2))
+    positions = force_directed_layout(matrix, positions, iterations)
+    if num_nodes > 1:
+        rows, cols = matrix.nonzero()
+        positions /= max(np.median(np.sqrt(((positions[rows] - positions[cols]) ** 2).sum(axis=-1))), 1e-9)
+    return positions
+
+
+def pack_components(layouts, padding=1.0):
+    """
+    Places the layouts of the connected components in rows, largest components first
+    :return: list of translated layouts
+    """
+    sizes = [layout.max(axis=0) - layout.min(axis=0) + padding for layout in layouts]
+    row_width = max(math.sqrt(sum(w * h for w, h in sizes)) * 1.2, max(w for w, _ in sizes))
+    packed = []
+    x, y, row_height = 0.0, 0.0, 0.0
+    for layout, (width, height) in zip(layouts, sizes):
+        if x > 0 and x + width > row_width:
+            x, y, row_height = 0.0, y + row_height, 0.0
+        packed.append(layout - layout.min(axis=0) + np.array([x, y]))
+        x += width
+        row_height = max(row_height, height)
+    return packed
+
+
+def graph_layout(num_nodes, edges):
+    """
+    :param edges: list of (source index, target index) tuples
+    :return: array with the position in pixels of each node
+    """
+    if num_nodes == 0:
+        return np.zeros((0, 2))
+    matrix = adjacency(num_nodes, edges)
+    num_components, labels = connected_components(matrix, directed=False)
+    components = [np.flatnonzero(labels == label) for label in range(num_components)]
+    components.sort(key=len, reverse=True)
+    layouts = [component_layout(matrix[component][:, component]) for component in components]
+    positions = np.zeros((num_nodes, 2))
+    for component, layout in zip(components, pack_components(layouts)):
+        positions[component] = layout
+    return positions * EDGE_LENGTH
+
+
+class LayoutCache:
+    """
+    Layouts of the graphs by fingerprint, see `explanation_store.canonical_graph`, so that each graph is laid out once
+    for all users
+    """
+
+    def __init__(self, max_size=LAYOUT_CACHE_SIZE):
+        self.max_size = max_size
+        self.layouts = OrderedDict()
+        self.lock = threading.Lock()
+
+    def positions(self, nodes, edges):
+        """
+        :param nodes: nodes in the format received by `predict` and `explain_*`
+        :param edges: list of (source index, target index) tuples
+        :return: (fingerprint of the graph, dictionary from node id to {"x", "y"} position in pixels)
+        """
+        fingerprint, _ = canonical_graph(nodes, edges)
+        with self.lock:
+            if fingerprint in self.layouts:
+                self.layouts.move_to_end(fingerprint)
+                return fingerprint, self.layouts[fingerprint]
+        layout = graph_layout(len(nodes), edges).round(1).tolist()
+        positions = {str(node['id']): {'x': x, 'y': y} for node, (x, y) in zip(nodes, layout)}
+        with self.lock:
+            self.layouts[fingerprint] = positions
+            while len(self.layouts) > self.max_size:
+                self.layouts.popitem(last=False)
+        return fingerprint, positions
@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+from collections import defaultdict
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Histogram, generate_latest
+
+# request metrics are only collected when the METRICS environment variable is set to 1
+METRICS_ENABLED = os.environ.get('METRICS', '0') == '1'
+
+DURATION_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+SIZE_BUCKETS = [10, 30, 100, 300, 1000, 3000, 10000, 30000, 100000, 300000]
+
+# only the metrics of this module are served by /metrics, not the process metrics of the default registry
+registry = CollectorRegistry()
+request_duration = Histogram('gnn_request_duration_seconds', 'Duration of the requests',
+                             ['endpoint', 'method', 'status'], buckets=DURATION_BUCKETS, registry=registry)
+stage_duration = Histogram('gnn_stage_duration_seconds', 'Duration of the stages of the requests',
+                           ['endpoint', 'method', 'stage'], buckets=DURATION_BUCKETS, registry=registry)
+graph_nodes = Histogram('gnn_request_graph_nodes', 'Number of nodes of the graphs in the requests',
+                        ['endpoint', 'method'], buckets=SIZE_BUCKETS, registry=registry)
+graph_edges = Histogram('gnn_request_graph_edges', 'Number of directed edges of the graphs in the requests',
+                        ['endpoint', 'method'], buckets=SIZE_BUCKETS, registry=registry)
+
+
+class NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_STAGE = NullStage()
+
+
+class Stage:
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timer.stages.append((self.name, time.perf_counter() - self.start))
+        return False
+
+
+class RequestTimer:
+    """
+    Timings and labels of the request handled by the current thread
+    """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.method = ''
+        self.start = time.perf_counter()
+        self.stages = []
+        self.sizes = None
+
+    def finish(self, status):
+        duration = time.perf_counter() - self.start
+        request_duration.labels(self.endpoint, self.method, str(status)).observe(duration)
+        totals = defaultdict(float)
+        for name, stage_time in self.stages:
+            totals[name] += stage_time
+        for name, stage_time in totals.items():
+            stage_duration.labels(self.endpoint, self.method, name).observe(stage_time)
+        if self.sizes is not None:
+            graph_nodes.labels(self.endpoint, self.method).observe(self.sizes[0])
+            graph_edges.labels(self.endpoint, self.method).observe(self.sizes[1])
+        timings = [f'{name};dur={stage_time * 1000:.2f}' for name, stage_time in totals.items()]
+        return ', '.join(timings + [f'total;dur={duration * 1000:.2f}'])
+
+
+local = threading.local()
+
+
+def start_request(endpoint):
+    local.timer = RequestTimer(endpoint)
+
+
+def finish_request(status):
+    """
+    Records the metrics of the current request
+    :return: value of the Server-Timing header, None if no request is timed
+    """
+    timer = getattr(local, 'timer', None)
+    if timer is None:
+        return None
+    local.timer = None
+    return timer.finish(status)
+
+
+def clear_request():
+    local.timer = None
+
+
+def stage(name):
+    """
+    Context manager measuring a stage of the current request, does nothing if metrics are disabled
+    """
+    timer = getattr(local, 'timer', None)
+    if timer is None:
+        return NULL_STAGE
+    return Stage(timer, name)
+
+
+def set_method(method):
+    timer = getattr(local, 'timer', None)
+    if timer is not None:
+        timer.method = method
+
+
+def set_graph_size(num_nodes, num_edges):
+    timer = getattr(local, 'timer', None)
+    if timer is not None:
+        timer.sizes = (num_nodes, num_edges)
+
+
+def render_metrics():
+    """
+    :return: (body, content type) of the metrics in the Prometheus text format
+    """
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,82 @@
+import cProfile
+import json
+import os
+import threading
+import time
+import uuid
+
+import torch
+
+# requests can only ask for a profile when the PROFILING environment variable is set to 1
+PROFILING_ENABLED = os.environ.get('PROFILING', '0') == '1'
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+# only the most recent profiles are kept
+MAX_PROFILES = int(os.environ.get('MAX_PROFILES', '20'))
+
+# profilers are not reentrant, requests asking for a profile are profiled one at a time
+profile_lock = threading.Lock()
+
+
+def torch_profiler():
+    # `torch.profiler` is only available on torch>=1.8.1, older versions have the autograd profiler
+    try:
+        from torch.profiler import profile, ProfilerActivity
+    except ImportError:
+        return torch.autograd.profiler.profile(record_shapes=True)
+    return profile(activities=[ProfilerActivity.CPU], record_shapes=True)
+
+
+def profile_call(info, function, *args, **kwargs):
+    """
+    Runs `function` under the torch profiler and cProfile and stores a Chrome trace (`<id>.trace.json`, open it in
+    chrome://tracing or https://ui.perfetto.dev), the cProfile statistics (`<id>.pstats`, open them with `pstats` or
+    snakeviz) and a description of the call (`<id>.json`) in `PROFILE_DIR`
+    :param info: dictionary describing the call, e.g. the endpoint, the method and the graph size
+    :return: (result of the function, profile id)
+    """
+    profile_id = time.strftime('%Y%m%d-%H%M%S-') + uuid.uuid4().hex[:8]
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with profile_lock:
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        with torch_profiler() as trace:
+            profiler.enable()
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                profiler.disable()
+        duration = time.perf_counter() - start
+    trace.export_chrome_trace(os.path.join(PROFILE_DIR, profile_id + '.trace.json'))
+    profiler.dump_stats(os.path.join(PROFILE_DIR, profile_id + '.pstats'))
+    info = dict(info, id=profile_id, duration=duration, created=time.time(),
+                files=[profile_id + '.trace.json', profile_id + '.pstats'])
+    with open(os.path.join(PROFILE_DIR, profile_id + '.json'), 'w') as f:
+        json.dump(info, f)
+    prune_profiles()
+    return result, profile_id
+
+
+def list_profiles():
+    """
+    :return: descriptions of the stored profiles, most recent first
+    """
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for filename in os.listdir(PROFILE_DIR):
+        if filename.endswith('.json') and not filename.endswith('.trace.json'):
+            try:
+                with open(os.path.join(PROFILE_DIR, filename)) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return sorted(profiles, key=lambda profile: profile['created'], reverse=True)
+
+
+def prune_profiles():
+    for profile in list_profiles()[MAX_PROFILES:]:
+        for filename in profile['files'] + [profile['id'] + '.json']:
+            try:
+                os.remove(os.path.join(PROFILE_DIR, filename))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,130 @@
+# Replays the requests recorded by the web service (see `traffic.py`) against a running server and reports latency
+# percentiles, throughput and error rate for each endpoint and explanation method.
+# Example: python replay_traffic.py traffic.jsonl --url http://localhost:5000 --concurrency 8 --rate 20
+
+import argparse
+import json
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+PERCENTILES = [50, 90, 95, 99]
+
+
+def load_recording(path, limit=None):
+    recorded = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                recorded.append(json.loads(line))
+            if limit is not None and len(recorded) >= limit:
+                break
+    return recorded
+
+
+def request_group(recorded):
+    """
+    :return: (endpoint, explanation method) used to aggregate the results
+    """
+    body = recorded.get('json') or {}
+    method = body.get('method', {}).get('name', '-') if isinstance(body.get('method'), dict) else '-'
+    return recorded['path'], method
+
+
+def send(session, url, recorded, timeout):
+    start = time.perf_counter()
+    try:
+        response = session.request(recorded['method'], url + recorded['path'], params=recorded.get('args'),
+                                    json=recorded.get('json'), timeout=timeout)
+        error = None if response.status_code < 400 else f'HTTP {response.status_code}'
+    except requests.RequestException as e:
+        error = type(e).__name__
+    return time.perf_counter() - start, error
+
+
+def replay(recorded, url, concurrency, rate, timeout, repeat=1):
+    """
+    Sends the recorded requests in order with at most `concurrency` requests in flight. With a `rate`, request i is
+    not sent before i / rate seconds after the start, so the rate is an upper bound if the server cannot keep up.
+    :return: (list of (group, latency, error) tuples, wall time)
+    """
+    local = threading.local()
+    recorded = recorded * repeat
+
+    def worker(idx):
+        if rate:
+            delay = start + idx / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        latency, error = send(local.session, url, recorded[idx], timeout)
+        return request_group(recorded[idx]), latency, error
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(worker, range(len(recorded))))
+    return results, time.perf_counter() - start
+
+
+def summarize(results, duration):
+    groups = defaultdict(list)
+    for group, latency, error in results:
+        groups[group].append((latency, error))
+        groups[('all', '-')].append((latency, error))
+    summary = []
+    for (endpoint, method), values in sorted(groups.items()):
+        latencies = np.array([latency for latency, _ in values]) * 1000
+        errors = defaultdict(int)
+        for _, error in values:
+            if error is not None:
+                errors[error] += 1
+        summary.append({'endpoint': endpoint,
+                        'method': method,
+                        'requests': len(values),
+                        'throughput': len(values) / duration,
+                        'error_rate': sum(errors.values()) / len(values),
+                        'errors': dict(errors),
+                        'latency_ms': {f'p{p}': float(np.percentile(latencies, p)) for p in PERCENTILES},
+                        'max_latency_ms': float(latencies.max())})
+    return summary
+
+
+def print_summary(summary, duration):
+    print(f'{"endpoint":>10} {"method":>22} {"requests":>8} {"req/s":>8} {"errors":>7} ' +
+          ' '.join(f'{"p%d" % p:>8}' for p in PERCENTILES) + f' {"max":>8}')
+    for row in summary:
+        print(f'{row["endpoint"]:>10} {row["method"]:>22} {row["requests"]:8} {row["throughput"]:8.2f} '
+              f'{row["error_rate"]:7.1%} ' + ' '.join(f'{row["latency_ms"]["p%d" % p]:8.1f}' for p in PERCENTILES) +
+              f' {row["max_latency_ms"]:8.1f}')
+    print(f'replayed in {duration:.1f}s, latencies in ms')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('recording', help='JSONL file written by the web service with RECORD_TRAFFIC')
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--concurrency', type=int, default=4, help='maximum number of requests in flight')
+    parser.add_argument('--rate', type=float, default=0, help='maximum requests per second, 0 for no limit')
+    parser.add_argument('--limit', type=int, help='only replay the first requests of the recording')
+    parser.add_argument('--repeat', type=int, default=1, help='number of times the recording is replayed')
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--output', help='JSON file for the report')
+    args = parser.parse_args()
+
+    recorded = load_recording(args.recording, args.limit)
+    print(f'replaying {len(recorded) * args.repeat} requests against {args.url}')
+    results, duration = replay(recorded, args.url.rstrip('/'), args.concurrency, args.rate, args.timeout, args.repeat)
+    summary = summarize(results, duration)
+    print_summary(summary, duration)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'duration': duration, 'summary': summary}, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import math
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# admission control of the explanations, disabled with ADMISSION_CONTROL=0
+ADMISSION_CONTROL = os.environ.get('ADMISSION_CONTROL', '1') == '1'
+CHEAP_CONCURRENCY = int(os.environ.get('CHEAP_CONCURRENCY', '4'))
+CHEAP_QUEUE_SIZE = int(os.environ.get('CHEAP_QUEUE_SIZE', '32'))
+EXPENSIVE_CONCURRENCY = int(os.environ.get('EXPENSIVE_CONCURRENCY', '2'))
+EXPENSIVE_QUEUE_SIZE = int(os.environ.get('EXPENSIVE_QUEUE_SIZE', '8'))
+# explanations expected to take less than this many seconds use the cheap lane
+CHEAP_SECONDS = float(os.environ.get('CHEAP_SECONDS', '0.25'))
+# methods that need at most one forward and backward, used until the cost model has timings for a method
+CHEAP_METHODS = ['sa', 'sa_node', 'random', 'distance', 'pagerank']
+CHEAP_MAX_EDGES = 20000
+
+
+class LaneFull(Exception):
+    def __init__(self, lane, retry_after):
+        super().__init__(f'the {lane} lane is full')
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+class QueueTimeout(Exception):
+    def __init__(self, lane, retry_after):
+        super().__init__(f'the deadline expired in the queue of the {lane} lane')
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+class Lane:
+    """
+    Runs at most `concurrency` explanations at a time and lets at most `queue_size` more wait for their turn
+    """
+
+    def __init__(self, name, concurrency, queue_size):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.condition = threading.Condition()
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        # moving average of the duration of the explanations, used for Retry-After
+        self.service_time = None
+        self.waits = deque(maxlen=1000)
+
+    def acquire(self, deadline=None):
+        """
+        Waits until the explanation can run
+        :param deadline: `explainers.deadline.Deadline` of the explanation, the explanation gives up waiting when it
+        expires
+        :return: time spent in the queue in seconds
+        :raises LaneFull: if the queue is full
+        :raises QueueTimeout: if the deadline expires before the explanation can run
+        """
+        start = time.perf_counter()
+        with self.condition:
+            if self.running >= self.concurrency and self.waiting >= self.queue_size:
+                self.rejected += 1
+                raise LaneFull(self.name, self.retry_after())
+            self.waiting += 1
+            while self.running >= self.concurrency:
+                if deadline is None:
+                    self.condition.wait()
+                    continue
+                remaining = deadline.remaining()
+                if remaining <= 0:
+                    self.waiting -= 1
+                    self.timed_out += 1
+                    raise QueueTimeout(self.name, self.retry_after())
+                self.condition.wait(timeout=remaining)
+            self.waiting -= 1
+            self.running += 1
+            self.admitted += 1
+            wait = time.perf_counter() - start
+            self.waits.append(wait)
+        return wait
+
+    def release(self, service_time):
+        with self.condition:
+            self.running -= 1
+            if self.service_time is None:
+                self.service_time = service_time
+            else:
+                self.service_time = 0.9 * self.service_time + 0.1 * service_time
+            self.condition.notify()
+
+    def retry_after(self):
+        # seconds until the queue is expected to have room again
+        service_time = self.service_time if self.service_time is not None else 1.0
+        return max(1, math.ceil((self.waiting + 1) * service_time / self.concurrency))
+
+    def stats(self):
+        with self.condition:
+            waits = np.array(self.waits) * 1000
+            return {'concurrency': self.concurrency,
+                    'queue_size': self.queue_size,
+                    'running': self.running,
+                    'waiting': self.waiting,
+                    'admitted': self.admitted,
+                    'rejected': self.rejected,
+                    'timed_out': self.timed_out,
+                    'service_time': self.service_time,
+                    'queue_wait_ms': {'mean': float(waits.mean()) if len(waits) else 0.0,
+                                      'p95': float(np.percentile(waits, 95)) if len(waits) else 0.0,
+                                      'max': float(waits.max()) if len(waits) else 0.0}}
+
+
+class Scheduler:
+    """
+    Separates cheap explanations from expensive ones, so that a few slow explanations cannot delay the interactive
+    ones. Explanations are classified by their runtime estimated by the cost model or, before the cost model has
+    timings for a method, by the method and the size of the graph.
+    """
+
+    def __init__(self, cost_model):
+        self.cost_model = cost_model
+        self.lanes = {'cheap': Lane('cheap', CHEAP_CONCURRENCY, CHEAP_QUEUE_SIZE),
+                      'expensive': Lane('expensive', EXPENSIVE_CONCURRENCY, EXPENSIVE_QUEUE_SIZE)}
+
+    def lane(self, experiment, method, params, receptive_nodes, receptive_edges):
+        """
+        :param receptive_nodes, receptive_edges: size of the part of the graph the explanation depends on, see
+        `BaseExperiment.receptive_field_size`
+        """
+        seconds, observations = self.cost_model.estimate(experiment.name, method, receptive_nodes, receptive_edges,
+                                                         params)
+        if observations > 0:
+            cheap = seconds < CHEAP_SECONDS
+        else:
+            cheap = method in CHEAP_METHODS and receptive_edges <= CHEAP_MAX_EDGES
+        return self.lanes['cheap' if cheap else 'expensive']
+
+    def stats(self):
+        return {name: lane.stats() for name, lane in self.lanes.items()}
@@ -0,0 +1,60 @@
+import json
+import os
+import random
+import threading
+import time
+
+# requests to these endpoints are recorded when the RECORD_TRAFFIC environment variable is set to a JSONL file
+RECORDED_ENDPOINTS = ['/predict', '/explain', '/samples']
+RECORD_TRAFFIC = os.environ.get('RECORD_TRAFFIC')
+# fraction of the requests which are recorded
+RECORD_SAMPLE_RATE = float(os.environ.get('RECORD_SAMPLE_RATE', '1.0'))
+# larger request bodies are not recorded
+RECORD_MAX_PAYLOAD_BYTES = int(os.environ.get('RECORD_MAX_PAYLOAD_BYTES', str(2 ** 20)))
+# recording stops when the file reaches this size
+RECORD_MAX_FILE_BYTES = int(os.environ.get('RECORD_MAX_FILE_BYTES', str(2 ** 30)))
+
+
+class TrafficRecorder:
+    """
+    Appends sampled requests to a JSONL file with one {"time", "method", "path", "args", "json"} object per line, the
+    format read by `replay_traffic.py`
+    """
+
+    def __init__(self, path, sample_rate=1.0, max_payload_bytes=2 ** 20, max_file_bytes=2 ** 30):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.max_payload_bytes = max_payload_bytes
+        self.max_file_bytes = max_file_bytes
+        self.lock = threading.Lock()
+        self.size = os.path.getsize(path) if os.path.exists(path) else 0
+        self.skipped = 0
+
+    def should_record(self, content_length):
+        if self.size >= self.max_file_bytes:
+            return False
+        if content_length is not None and content_length > self.max_payload_bytes:
+            self.skipped += 1
+            return False
+        return random.random() < self.sample_rate
+
+    def record(self, method, path, args, body):
+        line = json.dumps({'time': time.time(), 'method': method, 'path': path, 'args': args, 'json': body},
+                          separators=(',', ':')) + '\n'
+        if len(line) > self.max_payload_bytes:
+            self.skipped += 1
+            return
+        with self.lock:
+            if self.size >= self.max_file_bytes:
+                return
+            with open(self.path, 'a') as f:
+                f.write(line)
+            self.size += len(line)
+            if self.size >= self.max_file_bytes:
+                print(f'Traffic recording stopped, {self.path} reached {self.max_file_bytes} bytes')
+
+
+def recorder_from_environment():
+    if not RECORD_TRAFFIC:
+        return None
+    return TrafficRecorder(RECORD_TRAFFIC, RECORD_SAMPLE_RATE, RECORD_MAX_PAYLOAD_BYTES, RECORD_MAX_FILE_BYTES)
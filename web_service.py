@@ -1,21 +1,118 @@
+import os
+import time
 from collections import defaultdict
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, send_from_directory
 from flask_cors import CORS
+import numpy as np
+
+import compression
+import metrics
+import profiling
+from metrics import stage
+from traffic import RECORDED_ENDPOINTS, recorder_from_environment
 
 from experiments.base import BaseExperiment
 # noinspection PyUnresolvedReferences
 from experiments import *
+from explanation_store import ExplanationStore
+from cost_model import CostModel
+from explainers.deadline import Deadline
+from scheduler import ADMISSION_CONTROL, LaneFull, QueueTimeout, Scheduler
+from graph_layout import LayoutCache
+
+# one of `experiments.inference.BACKENDS`, used for the predictions of all experiments
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'eager')
+# comma separated names of the experiments served with int8 quantized models
+QUANTIZED_EXPERIMENTS = os.environ.get('QUANTIZED_EXPERIMENTS', '').split(',')
+# quantized models are only used if this fraction of their predictions on the sample graphs is unchanged
+QUANTIZATION_MIN_AGREEMENT = float(os.environ.get('QUANTIZATION_MIN_AGREEMENT', '1.0'))
+# longer deadlines of /explain requests are lowered to this many seconds
+MAX_DEADLINE = float(os.environ.get('MAX_DEADLINE', '60'))
 
 experiments_registry = dict()
 for cls in BaseExperiment.__subclasses__():
     try:
-        experiments_registry[str(len(experiments_registry))] = cls()
+        experiment = cls()
     except NotImplementedError:
         print(f'Ignoring experiment class {cls} since the constructor is not implemented')
+        continue
+    if experiment.name not in QUANTIZED_EXPERIMENTS or not experiment.enable_quantization(QUANTIZATION_MIN_AGREEMENT):
+        experiment.set_inference_backend(INFERENCE_BACKEND)
+    experiments_registry[str(len(experiments_registry))] = experiment
+
+explanation_stores = {id: ExplanationStore.load(experiment.name) for id, experiment in experiments_registry.items()}
+# runtime estimates of the explanation methods, refined with the duration of every explanation
+cost_model = CostModel.load()
+# separate lanes for cheap and expensive explanations, see `scheduler.Scheduler`
+scheduler = Scheduler(cost_model) if ADMISSION_CONTROL else None
+# node positions of the graphs sent to the UI, computed once per graph
+layouts = LayoutCache()
 
 app = Flask(__name__, static_url_path='/', static_folder='web/dist/')
-CORS(app)
+CORS(app, expose_headers=['Server-Timing', 'X-Profile-Id', 'X-Early-Stop', 'X-Queue-Wait', 'Retry-After'])
+
+
+def start_metrics():
+    if request.endpoint == 'metrics_endpoint':
+        return
+    metrics.start_request(request.endpoint or 'unknown')
+    if request.is_json:
+        with stage('parse'):
+            request.get_json()
+
+
+def finish_metrics(response):
+    server_timing = metrics.finish_request(response.status_code)
+    if server_timing is not None:
+        response.headers['Server-Timing'] = server_timing
+    return response
+
+
+def clear_metrics(exception):
+    metrics.clear_request()
+
+
+# the hooks are only installed when metrics are enabled so that they cost nothing otherwise
+if metrics.METRICS_ENABLED:
+    app.before_request(start_metrics)
+    app.after_request(finish_metrics)
+    app.teardown_request(clear_metrics)
+
+traffic_recorder = recorder_from_environment()
+
+
+def record_traffic():
+    if request.path in RECORDED_ENDPOINTS and traffic_recorder.should_record(request.content_length):
+        traffic_recorder.record(request.method, request.path, request.args.to_dict(), request.get_json(silent=True))
+
+
+if traffic_recorder is not None:
+    app.before_request(record_traffic)
+
+
+def compress_response(response):
+    if response.direct_passthrough or response.status_code != 200 or response.mimetype != 'application/json' \
+            or 'Content-Encoding' in response.headers:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = compression.choose_encoding(request.headers.get('Accept-Encoding', ''))
+    if encoding is None or (response.content_length or 0) < compression.COMPRESS_MIN_BYTES:
+        return response
+    with stage('compress'):
+        response.set_data(compression.compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+# registered after the metrics hooks so that it runs before `finish_metrics`
+app.after_request(compress_response)
+
+
+def set_metrics_labels(method, nodes, edges):
+    # unknown method names are not used as labels to bound the number of series
+    metrics.set_method(method if method in METHODS_PRETTY_NAMES else 'unknown')
+    metrics.set_graph_size(len(nodes), len(edges))
 
 
 def make_node_mappings(elements):
@@ -52,8 +149,11 @@ def predict():
     experiment_id = request.json['experiment_id']
     experiment: BaseExperiment = experiments_registry[experiment_id]
     nodes, edges = request.json['nodes'], request.json['edges']
-    node_id_to_index, node_index_to_id = make_node_mappings(nodes)
-    converted_edges, edge_index_to_id = make_edges(edges, node_id_to_index, experiment.is_directed())
+    with stage('mappings'):
+        node_id_to_index, node_index_to_id = make_node_mappings(nodes)
+    with stage('make_edges'):
+        converted_edges, edge_index_to_id = make_edges(edges, node_id_to_index, experiment.is_directed())
+    metrics.set_graph_size(len(nodes), len(converted_edges))
     preds = experiment.predict(nodes, converted_edges)
     if experiment.is_graph_classification():
         return preds
@@ -63,6 +163,21 @@ def predict():
     return id_to_pred
 
 
+@app.route('/predict_batch', methods=['POST'])
+def predict_batch():
+    experiment_id = request.json['experiment_id']
+    experiment: BaseExperiment = experiments_registry[experiment_id]
+    if not experiment.is_graph_classification():
+        return {'error': 'batch prediction is only supported for graph classification experiments'}, 400
+    graphs = []
+    for graph in request.json['graphs']:
+        nodes, edges = graph['nodes'], graph['edges']
+        node_id_to_index, node_index_to_id = make_node_mappings(nodes)
+        converted_edges, edge_index_to_id = make_edges(edges, node_id_to_index, experiment.is_directed())
+        graphs.append((nodes, converted_edges))
+    return jsonify(experiment.predict_batch(graphs))
+
+
 @app.route('/explain', methods=['POST'])
 def explain():
     experiment_id = request.json['experiment_id']
@@ -71,27 +186,303 @@ def explain():
     method = request.json['method']
     target = request.json['target']
     node_id = request.json['node_id']
+    # optional time budget in seconds, iterative methods return their best result so far when it expires
+    deadline = None
+    if request.json.get('deadline') is not None:
+        try:
+            seconds = float(request.json['deadline'])
+        except (TypeError, ValueError):
+            return {'error': 'deadline must be a number of seconds'}, 400
+        if not seconds > 0:
+            return {'error': 'deadline must be positive'}, 400
+        deadline = Deadline(min(seconds, MAX_DEADLINE))
+    # profiles the explanation method for this request, see `profiling.profile_call`
+    profile = request.json.get('profile', False)
+    if profile and not profiling.PROFILING_ENABLED:
+        return {'error': 'profiling is disabled, set PROFILING=1 to enable it'}, 403
+    try:
+        options = attribution_options(request.json)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    with stage('mappings'):
+        node_id_to_index, node_index_to_id = make_node_mappings(nodes)
+    with stage('make_edges'):
+        converted_edges, edge_index_to_id = make_edges(edges, node_id_to_index, experiment.is_directed())
+    set_metrics_labels(method['name'], nodes, converted_edges)
+    node_index = None if experiment.is_graph_classification() else node_id_to_index[node_id]
+    attributions = None
+    profile_id = None
+    store = explanation_stores[experiment_id]
+    if store is not None and not profile:
+        with stage('store_lookup'):
+            attributions = store.lookup(nodes, converted_edges, node_index, target, method)
+    queue_wait = None
+    if attributions is None:
+        if experiment.is_graph_classification():
+            explain_function, args = experiment.explain_graph, (nodes, converted_edges, target, method, deadline)
+        else:
+            explain_function = experiment.explain_node
+            args = (nodes, converted_edges, node_index, target, method, deadline)
+        method_name, params = method['name'], {k: v for k, v in method.items() if k != 'name'}
+        receptive_nodes, receptive_edges = experiment.receptive_field_size(nodes, converted_edges, node_index)
+        lane = None
+        if scheduler is not None:
+            lane = scheduler.lane(experiment, method_name, params, receptive_nodes, receptive_edges)
+            try:
+                # the time spent in the queue counts towards the deadline
+                with stage('queue'):
+                    queue_wait = lane.acquire(deadline)
+            except LaneFull as e:
+                return {'error': f'too many pending explanations in the {e.lane} lane'}, 503, \
+                       {'Retry-After': str(e.retry_after)}
+            except QueueTimeout as e:
+                return {'error': f'the deadline expired while waiting in the {e.lane} lane'}, 503, \
+                       {'Retry-After': str(e.retry_after)}
+        start = time.perf_counter()
+        try:
+            if profile:
+                info = {'experiment': experiment.name, 'method': dict(method), 'node_index': node_index,
+                        'target': target, 'num_nodes': len(nodes), 'num_edges': len(converted_edges)}
+                attributions, profile_id = profiling.profile_call(info, explain_function, *args)
+            else:
+                attributions = explain_function(*args)
+        finally:
+            if lane is not None:
+                lane.release(time.perf_counter() - start)
+        # partial explanations would bias the estimates
+        if not profile and (deadline is None or not deadline.stopped_early):
+            cost_model.observe({'experiment': experiment.name, 'method': method_name, 'params': params,
+                                'nodes': len(nodes), 'edges': len(converted_edges), 'receptive_nodes': receptive_nodes,
+                                'receptive_edges': receptive_edges, 'seconds': time.perf_counter() - start})
+    with stage('serialize'):
+        if options['sparse']:
+            response = jsonify(dict(sparse_attributions(attributions, edge_index_to_id, options), num_edges=len(edges)))
+        else:
+            edge_id_to_attribution = defaultdict(float)
+
+            # for undirected graphs we return the attribution of each edge as the sum of both directions
+            for idx, attribution in enumerate(attributions.tolist()):
+                edge_id_to_attribution[edge_index_to_id[idx]] += attribution
+            values = round_attributions(list(edge_id_to_attribution.values()), options['precision'])
+            response = jsonify(dict(zip(edge_id_to_attribution.keys(), values)))
+    if profile_id is not None:
+        response.headers['X-Profile-Id'] = profile_id
+    if deadline is not None:
+        response.headers['X-Early-Stop'] = 'true' if deadline.stopped_early else 'false'
+    if queue_wait is not None:
+        response.headers['X-Queue-Wait'] = '%.1f' % (queue_wait * 1000)
+    return response
+
+
+# significant digits of the attributions in the responses, the JSON numbers carry about as much information as the
+# binary format of the same name
+PRECISION_DIGITS = {'float16': 3, 'float32': 7}
+
+
+def json_number(body, name, convert):
+    value = body.get(name)
+    if value is None:
+        return None
+    try:
+        return convert(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be {"an integer" if convert is int else "a number"}')
+
+
+def attribution_options(body):
+    # `top_k`, `threshold` (minimum absolute attribution) and `relative_threshold` (minimum fraction of the largest
+    # absolute attribution) select a sparse response with the most important edges only, `precision` is one of
+    # `PRECISION_DIGITS`
+    precision = body.get('precision', 'float16')
+    if precision not in PRECISION_DIGITS:
+        raise ValueError(f'precision must be one of {list(PRECISION_DIGITS)}')
+    top_k = json_number(body, 'top_k', int)
+    threshold = json_number(body, 'threshold', float) or 0.0
+    relative_threshold = json_number(body, 'relative_threshold', float) or 0.0
+    if top_k is not None and top_k < 1:
+        raise ValueError('top_k must be at least 1')
+    if not threshold >= 0:
+        raise ValueError('threshold must be non-negative')
+    if not 0 <= relative_threshold <= 1:
+        raise ValueError('relative_threshold must be between 0 and 1')
+    return {'sparse': bool(body.get('sparse')) or top_k is not None or threshold > 0 or relative_threshold > 0,
+            'top_k': top_k, 'threshold': threshold, 'relative_threshold': relative_threshold, 'precision': precision}
+
+
+def round_attributions(values, precision):
+    format_string = '%%.%de' % (PRECISION_DIGITS[precision] - 1)
+    return [float(format_string % value) for value in values]
+
+
+def sparse_attributions(attributions, edge_index_to_id, options):
+    # edges whose absolute attribution passes the thresholds, by decreasing absolute attribution. Only the nonzero
+    # attributions are aggregated, e.g. the edges outside the receptive field of the node are skipped.
+    attributions = np.asarray(attributions, dtype=np.float64)
+    edge_id_to_attribution = defaultdict(float)
+    for idx in np.flatnonzero(attributions).tolist():
+        edge_id_to_attribution[edge_index_to_id[idx]] += attributions[idx]
+    edge_ids = list(edge_id_to_attribution.keys())
+    values = np.fromiter(edge_id_to_attribution.values(), dtype=np.float64, count=len(edge_ids))
+    magnitudes = np.abs(values)
+    threshold = max(options['threshold'], options['relative_threshold'] * magnitudes.max(initial=0.0))
+    selected = np.flatnonzero((magnitudes >= threshold) & (magnitudes > 0))
+    selected = selected[np.argsort(-magnitudes[selected], kind='stable')][:options['top_k']]
+    return {'edges': [edge_ids[idx] for idx in selected.tolist()],
+            'attributions': round_attributions(values[selected].tolist(), options['precision'])}
+
+
+@app.route('/estimate', methods=['POST'])
+def estimate():
+    # expected runtime of every explanation method for the graph, `params` optionally maps method names to the
+    # parameters that would be sent to `/explain`
+    experiment_id = request.json['experiment_id']
+    experiment: BaseExperiment = experiments_registry[experiment_id]
+    nodes, edges = request.json['nodes'], request.json['edges']
+    params = request.json.get('params', {})
+    node_id_to_index, node_index_to_id = make_node_mappings(nodes)
+    converted_edges, edge_index_to_id = make_edges(edges, node_id_to_index, experiment.is_directed())
+    node_index = None if experiment.is_graph_classification() else node_id_to_index[request.json['node_id']]
+    receptive_nodes, receptive_edges = experiment.receptive_field_size(nodes, converted_edges, node_index)
+    result = {}
+    for method in experiment.get_explain_methods():
+        seconds, observations = cost_model.estimate(experiment.name, method, receptive_nodes, receptive_edges,
+                                                    params.get(method, {}))
+        result[method] = {'seconds': seconds, 'observations': observations}
+    return result
+
+
+@app.route('/stored/predict', methods=['POST'])
+def stored_predict():
+    experiment_id = request.json['experiment_id']
+    experiment: BaseExperiment = experiments_registry[experiment_id]
+    if experiment.graph_store() is None:
+        return {'error': f'experiment {experiment.name} has no graph store'}, 404
+    node_ids = request.json['node_ids']
+    preds = experiment.predict_stored_nodes(node_ids)
+    return dict(zip(map(str, node_ids), preds))
+
+
+@app.route('/stored/explain', methods=['POST'])
+def stored_explain():
+    experiment_id = request.json['experiment_id']
+    experiment: BaseExperiment = experiments_registry[experiment_id]
+    if experiment.graph_store() is None:
+        return {'error': f'experiment {experiment.name} has no graph store'}, 404
+    method = request.json['method']
+    target = request.json['target']
+    node_id = request.json['node_id']
+    edges, attributions = experiment.explain_stored_node(node_id, target, method)
+    edge_to_attribution = defaultdict(float)
+
+    # for undirected graphs we return the attribution of each edge as the sum of both directions
+    for (u, v), attribution in zip(edges.tolist(), attributions.tolist()):
+        if not experiment.is_directed() and u > v:
+            u, v = v, u
+        edge_to_attribution[(u, v)] += attribution
+    return jsonify([{'source': u, 'target': v, 'attribution': float('%.2e' % value)}
+                    for (u, v), value in edge_to_attribution.items()])
+
+
+@app.route('/stored/subgraph')
+def stored_subgraph():
+    experiment_id = request.args.get('experiment_id')
+    experiment: BaseExperiment = experiments_registry[experiment_id]
+    if experiment.graph_store() is None:
+        return {'error': f'experiment {experiment.name} has no graph store'}, 404
+    node_id = int(request.args.get('node_id'))
+    num_hops = int(request.args.get('num_hops', experiment.num_hops()))
+    subset, data, mapping = experiment.stored_subgraph([node_id], num_hops)
+    categories = experiment.graph_store().categories[subset].tolist()
+    nodes = [{'feat': feat, 'id': node} for node, feat in zip(subset.tolist(), categories)]
+    edges = subset[data.edge_index.numpy()].T.tolist()
+    if not experiment.is_directed():
+        edges = [[u, v] for u, v in edges if u <= v]
+    return jsonify(with_positions({'nodes': nodes, 'edges': edges, 'name': f'{num_hops}-hop from node {node_id}'}))
+
+
+@app.route('/counterfactual', methods=['POST'])
+def counterfactual():
+    experiment_id = request.json['experiment_id']
+    experiment: BaseExperiment = experiments_registry[experiment_id]
+    nodes, edges = request.json['nodes'], request.json['edges']
+    target = request.json['target']
+    params = request.json.get('params', {})
     node_id_to_index, node_index_to_id = make_node_mappings(nodes)
     converted_edges, edge_index_to_id = make_edges(edges, node_id_to_index, experiment.is_directed())
     if experiment.is_graph_classification():
-        attributions = experiment.explain_graph(nodes, converted_edges, target, method)
+        result = experiment.counterfactual_graph(nodes, converted_edges, target, params)
     else:
-        attributions = experiment.explain_node(nodes, converted_edges, node_id_to_index[node_id], target, method)
-    edge_id_to_attribution = defaultdict(float)
+        result = experiment.counterfactual_node(nodes, converted_edges, node_id_to_index[request.json['node_id']],
+                                                target, params)
+    # both directions of undirected edges are deleted together and have the same id
+    edge_ids = []
+    for idx in result['edges']:
+        if edge_index_to_id[idx] not in edge_ids:
+            edge_ids.append(edge_index_to_id[idx])
+    result['edges'] = edge_ids
+    return result
 
-    # for undirected graphs we return the attribution of each edge as the sum of both directions
-    for idx, attribution in enumerate(attributions.tolist()):
-        edge_id_to_attribution[edge_index_to_id[idx]] += attribution
-    edge_id_to_attribution = {k: float('%.2e' % value) for k, value in edge_id_to_attribution.items()}
-    return edge_id_to_attribution
+
+MAX_PAGE_SIZE = 200
+# parameters of /samples which select a page of the samples, without them all the samples are returned as a list
+SAMPLES_PARAMETERS = ['offset', 'limit', 'label', 'min_nodes', 'max_nodes', 'categories']
+
+
+def optional_int(name, minimum=0):
+    value = request.args.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an integer')
+    if value < minimum:
+        raise ValueError(f'{name} must be at least {minimum}')
+    return value
 
 
 @app.route('/samples')
 def samples():
     experiment_id = request.args.get('experiment_id')
     experiment: BaseExperiment = experiments_registry[experiment_id]
-    graphs = experiment.sample_graphs()
-    return jsonify(graphs)
+    if not any(name in request.args for name in SAMPLES_PARAMETERS):
+        graphs = [with_positions(graph) for graph in experiment.sample_graphs() or []]
+        return jsonify(graphs)
+    try:
+        offset = optional_int('offset') or 0
+        limit = min(optional_int('limit', minimum=1) or 50, MAX_PAGE_SIZE)
+        categories = request.args.get('categories')
+        if categories and not all(category.strip().isdigit() for category in categories.split(',')):
+            raise ValueError('categories must be comma separated category values')
+        filters = {'label': optional_int('label'),
+                   'min_nodes': optional_int('min_nodes'),
+                   'max_nodes': optional_int('max_nodes'),
+                   'categories': [int(category) for category in categories.split(',')] if categories else None}
+        total, graphs = experiment.sample_graphs_page(offset, limit, filters)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    return jsonify({'total': total, 'offset': offset, 'samples': [with_positions(graph) for graph in graphs]})
+
+
+def with_positions(graph):
+    # adds the `positions` of the nodes to a graph in the format of `sample_graphs`, so that the UI does not need to
+    # run a layout
+    node_id_to_index, node_index_to_id = make_node_mappings(graph['nodes'])
+    edges = [(node_id_to_index[u], node_id_to_index[v]) for u, v in graph['edges']]
+    with stage('layout'):
+        fingerprint, positions = layouts.positions(graph['nodes'], edges)
+    return dict(graph, positions=positions)
+
+
+@app.route('/layout', methods=['POST'])
+def layout():
+    # node positions of a graph in the format received by `/explain`, e.g. after the user edited it
+    nodes, edges = request.json['nodes'], request.json['edges']
+    node_id_to_index, node_index_to_id = make_node_mappings(nodes)
+    edges = [(node_id_to_index[edge['source']], node_id_to_index[edge['target']]) for edge in edges]
+    with stage('layout'):
+        fingerprint, positions = layouts.positions(nodes, edges)
+    return jsonify({'hash': fingerprint, 'positions': positions})
 
 
 METHODS_PRETTY_NAMES = {
@@ -105,7 +496,10 @@ METHODS_PRETTY_NAMES = {
     'distance': 'Distance',
     'gradXact': 'gradXact',
     'pgmexplainer': 'PGMExplainer',
-    'occlusion': 'Occlusion'
+    'occlusion': 'Occlusion',
+    'occlusion_hierarchical': 'Hierarchical Occlusion',
+    'shapley': 'Shapley',
+    'counterfactual': 'Counterfactual',
 }
 
 
@@ -120,10 +514,41 @@ def experiments():
                       'style': experiment.custom_style(),
                       'directed': experiment.is_directed(),
                       'graph_classification': experiment.is_graph_classification(),
+                      'server_resident': experiment.graph_store() is not None,
                       'methods': methods}
     return result
 
 
+@app.route('/profiles')
+def profiles():
+    if not profiling.PROFILING_ENABLED:
+        return {'error': 'profiling is disabled, set PROFILING=1 to enable it'}, 403
+    return jsonify(profiling.list_profiles())
+
+
+@app.route('/profiles/<path:filename>')
+def profile_file(filename):
+    if not profiling.PROFILING_ENABLED:
+        return {'error': 'profiling is disabled, set PROFILING=1 to enable it'}, 403
+    return send_from_directory(os.path.abspath(profiling.PROFILE_DIR), filename, as_attachment=True)
+
+
+@app.route('/scheduler')
+def scheduler_stats():
+    # occupancy and queue wait times of the lanes
+    if scheduler is None:
+        return {'error': 'admission control is disabled'}, 404
+    return scheduler.stats()
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if not metrics.METRICS_ENABLED:
+        return {'error': 'metrics are disabled, set METRICS=1 to enable them'}, 404
+    body, content_type = metrics.render_metrics()
+    return Response(body, content_type=content_type)
+
+
 @app.route('/')
 def root():
     return app.send_static_file('index.html')